@@ -0,0 +1,155 @@
+"""
+Transposition augmentation on vocabulary index arrays, without going back
+to music21.
+
+Transposing by s semitones is a lookup table over the vocabulary: every
+note and 'cont' token maps to the same kind of token s semitones away,
+'.' and 'rest' map to themselves. Tokens pushed out of the vocabulary's
+note range (C2-C6 for vocab.VOCAB, see util.get_normalized_note_names)
+are handled by mode:
+
+    'drop'  the table holds -1 for them, and a chorale containing one is
+            not transposed by that shift
+    'clip'  they are moved back into range by whole octaves
+"""
+from functools import lru_cache
+
+import numpy as np
+
+import token_store
+from vocab import vocab_tables
+
+# All 12 transpositions, within a tritone of the original key
+SHIFTS = tuple(range(-6, 6))
+
+
+@lru_cache(maxsize=None)
+def _transposition_table(vocab, shift, mode):
+    midi, is_cont, _ = vocab_tables(vocab)
+    is_note = midi >= 0
+    low, high = midi[is_note].min(), midi[is_note].max()
+
+    index = np.full((128, 2), -1, dtype=np.int64)
+    index[midi[is_note], is_cont[is_note].astype(np.int64)] = np.flatnonzero(is_note)
+
+    target = midi + shift
+    if mode == 'clip':
+        target = np.where(target < low, target + 12 * ((low - target + 11) // 12), target)
+        target = np.where(target > high, target - 12 * ((target - high + 11) // 12), target)
+    elif mode != 'drop':
+        raise ValueError(f"mode must be 'drop' or 'clip', not {mode!r}")
+
+    in_range = (target >= low) & (target <= high)
+    table = np.arange(len(vocab), dtype=np.int64)
+    table[is_note] = -1
+    ok = is_note & in_range
+    table[ok] = index[target[ok], is_cont[ok].astype(np.int64)]
+    table.flags.writeable = False
+    return table
+
+
+def transposition_table(vocab, shift, mode='drop'):
+    """
+    Vocabulary index -> index of the token transposed by shift semitones.
+
+    Args:
+        vocab (list): Token name for each index (e.g. store.vocab).
+        shift (int): Semitones, positive is up.
+        mode (str): 'drop' or 'clip' (see module docstring).
+
+    Returns:
+        np.ndarray: (len(vocab),) read-only int64 table, -1 where the
+        transposed token is not in the vocabulary.
+    """
+    return _transposition_table(tuple(vocab), int(shift), mode)
+
+
+def valid_shifts(tokens, offsets, vocab, shifts=SHIFTS, mode='drop'):
+    """
+    Which shifts keep every token of each chorale in the vocabulary.
+
+    Args:
+        tokens (np.ndarray): Packed (num_voices, num_tokens) index array,
+            e.g. TokenStore.tokens.
+        offsets (np.ndarray): Chorale i spans offsets[i]:offsets[i+1].
+        vocab (list): Token name for each index.
+        shifts (tuple): Semitone shifts to check.
+        mode (str): With 'clip' every shift is valid.
+
+    Returns:
+        np.ndarray: (num_chorales, len(shifts)) bool.
+    """
+    tokens = np.asarray(tokens)
+    starts = np.asarray(offsets[:-1])
+    valid = np.empty((len(starts), len(shifts)), dtype=bool)
+    for k, shift in enumerate(shifts):
+        bad = (transposition_table(vocab, shift, mode)[tokens] < 0).any(axis=0)
+        valid[:, k] = ~np.logical_or.reduceat(bad, starts)
+    return valid
+
+
+def transpose_corpus(tokens, offsets, vocab, shifts=SHIFTS, mode='drop'):
+    """
+    Every valid transposition of every chorale of a packed array, with
+    one table lookup over the whole array per shift.
+
+    Returns:
+        tokens (np.ndarray): (num_voices, total) transposed chorales, all
+            transpositions of the first shift first.
+        offsets (np.ndarray): Chorale boundaries in tokens.
+        sources (np.ndarray): (num_out, 2) original chorale index and shift
+            of each output chorale.
+    """
+    tokens = np.asarray(tokens)
+    offsets = np.asarray(offsets)
+    lengths = np.diff(offsets)
+    valid = valid_shifts(tokens, offsets, vocab, shifts, mode)
+
+    out, out_lengths, sources = [], [], []
+    for k, shift in enumerate(shifts):
+        keep = np.repeat(valid[:, k], lengths)
+        out.append(transposition_table(vocab, shift, mode)[tokens[:, keep]].astype(tokens.dtype))
+        kept = np.flatnonzero(valid[:, k])
+        out_lengths.append(lengths[kept])
+        sources.append(np.stack([kept, np.full(len(kept), shift)], axis=1))
+
+    out_offsets = np.zeros(sum(len(l) for l in out_lengths) + 1, dtype=np.int64)
+    np.cumsum(np.concatenate(out_lengths), out=out_offsets[1:])
+    return np.concatenate(out, axis=1), out_offsets, np.concatenate(sources)
+
+
+def transpose_store(store, path, shifts=SHIFTS, mode='drop'):
+    """
+    Pack all valid transpositions of a TokenStore into a new store. Keys
+    are the original keys with the shift appended, e.g. 'bach/bwv1.6.mxl+3'.
+
+    Returns:
+        TokenStore: The augmented store.
+    """
+    tokens, offsets, sources = transpose_corpus(store.tokens, store.offsets, store.vocab,
+                                                shifts, mode)
+    chorales = [{voice: tokens[v, offsets[i]:offsets[i + 1]]
+                 for v, voice in enumerate(store.voices)}
+                for i in range(len(sources))]
+    keys = [f"{store.keys[i]}{shift:+d}" for i, shift in sources.tolist()]
+    return token_store.pack_corpus(chorales, path, store.vocab, keys=keys, voices=store.voices)
+
+
+class RandomTransposition:
+    """
+    Transform for model.StreamingWindows: each time a chorale is reached it
+    is transposed by a shift drawn from those valid for it, so every epoch
+    sees a different key and nothing is precomputed.
+    """
+
+    def __init__(self, vocab, shifts=SHIFTS, mode='drop'):
+        self.shifts = tuple(shifts)
+        self.tables = np.stack([transposition_table(vocab, s, mode) for s in self.shifts])
+
+    def __call__(self, notes, rng):
+        # notes: (T, num_voices) index array of one chorale
+        transposed = self.tables[:, notes]
+        ok = np.flatnonzero((transposed >= 0).reshape(len(self.shifts), -1).all(axis=1))
+        if not len(ok):
+            return notes
+        return transposed[rng.choice(ok)]
@@ -0,0 +1,431 @@
+"""
+Benchmarks for every pipeline stage, on synthetic inputs so no corpus is
+needed, plus comparisons of the fast paths in util against the
+implementations they replaced.
+
+Run the suite with: python benchmarks.py [--sizes 100 1000 5000]
+[--output results.json] [--baseline benchmarks_baseline.json]
+Add --save-baseline to store the results as the new baseline; otherwise
+each case is checked against the baseline and the run fails if one is
+slower than its threshold allows.
+"""
+import os
+import sys
+import copy
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import contextlib
+
+import numpy as np
+import torch
+
+import util
+import vocab
+
+
+def extract_notes_and_durations_cont_reference(score, time_step=0.25):
+    """
+    Previous, per-step implementation of util.extract_notes_and_durations_cont,
+    kept as the correctness and speed baseline. Mutates pitches in score.
+
+    Args:
+        score (music21.stream.Score): Input Score.
+        time_step (float): Temporal resolution (e.g., 0.5 = eighth notes).
+
+    Returns:
+        (note_dict, duration_dict): Dicts of aligned note names and durations.
+    """
+    note_dict = {}
+    duration_dict = {}
+    part_duration = {}
+    min_dur = 100.
+
+    for part in score.parts:
+        part_id = part.id or f"Part{len(note_dict)+1}"
+        note_dict[part_id] = []
+        duration_dict[part_id] = []
+        part_duration[part_id] = 0.
+        
+        
+        cur_min_dur = min([s.quarterLength for s in part.recurse().notesAndRests])
+        if cur_min_dur < min_dur:
+            min_dur = cur_min_dur
+            
+        for n in part.recurse().notesAndRests:
+                        
+            dur = n.quarterLength
+            if dur == 0.:
+                continue
+            
+            part_duration[part_id] += dur
+            steps = int(dur / time_step)
+            if steps < 1:
+                steps = 1
+
+            if n.isRest:
+                note_name = 'rest'
+            elif n.isNote:
+                if '#' in n.pitch.name:
+                    n.pitch = n.pitch.getEnharmonic()
+                if n.pitch.name == 'F-':
+                    n.pitch.name = 'E'
+                if n.pitch.name == 'C-':
+                    n.pitch.name = 'B'
+                note_name = n.nameWithOctave
+            else:
+                # print('What is this!')
+                pass
+
+            note_dict[part_id].append(note_name)
+            duration_dict[part_id].append(time_step)
+
+            for _ in range(1, steps):
+                if n.isRest:
+                    cont_token = note_name
+                elif n.isNote:
+                    cont_token = f"cont{note_name}"
+                note_dict[part_id].append(cont_token)
+                duration_dict[part_id].append(time_step)
+                
+
+    return note_dict, duration_dict, part_duration, min_dur
+
+
+def reconstruct_score_cont_reference(note_dict, time_step=0.25):
+    """
+    Previous, per-token implementation of util.reconstruct_score_cont,
+    kept as the correctness and speed baseline.
+
+    Args:
+        note_dict (dict): {part_name: [note names or 'rest' or 'cont<Note>']}
+        time_step (float): Duration of each time step.
+
+    Returns:
+        music21.stream.Score
+    """
+    from music21 import stream, note
+
+    score = stream.Score()
+
+    for part_name in note_dict:
+        p = stream.Part()
+        p.id = part_name
+        p.partName = part_name.capitalize()
+
+        notes = note_dict[part_name]
+        i = 0
+        while i < len(notes):
+            symbol = notes[i]
+            if symbol.startswith('cont'):
+                i += 1
+                continue
+
+            # Determine how long this note continues
+            dur = time_step
+            j = i + 1
+            while j < len(notes) and notes[j] == f'cont{symbol}':
+                dur += time_step
+                j += 1
+
+            if symbol == 'rest':
+                p.append(note.Rest(quarterLength=dur))
+            else:
+                p.append(note.Note(symbol, quarterLength=dur))
+
+            i = j
+
+        score.append(p)
+
+    return score
+
+
+def synthetic_dicts(num_notes=200, seed=0):
+    """
+    Random 4-part note and duration dicts with num_notes notes per part.
+    """
+    random.seed(seed)
+    parts = ['soprano', 'alto', 'tenor', 'bass']
+    return util.generate_random_note_and_duration_dicts(
+        parts, {part: num_notes for part in parts})
+
+
+def synthetic_score(num_notes=200, seed=0):
+    """
+    Random 4-part score with num_notes notes per part.
+    """
+    return util.reconstruct_score(*synthetic_dicts(num_notes, seed))
+
+
+def best_time(fn, repeats=5):
+    best = float('inf')
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def bench_extract_notes_and_durations_cont(num_notes=200, time_step=0.25, repeats=5):
+    """
+    Time the fast extractor against the reference on one synthetic score
+    and check both give identical output.
+    """
+    score = synthetic_score(num_notes)
+    ref_score = copy.deepcopy(score)
+
+    fast = util.extract_notes_and_durations_cont(score, time_step)
+    ref = extract_notes_and_durations_cont_reference(ref_score, time_step)
+    assert fast == ref, 'fast extractor output differs from reference'
+
+    # The reference respells pitches in place, so later runs do less work;
+    # time it on fresh copies to keep the comparison fair.
+    copies = [copy.deepcopy(score) for _ in range(repeats)]
+    t_fast = best_time(lambda: util.extract_notes_and_durations_cont(score, time_step), repeats)
+    t_ref = best_time(lambda: extract_notes_and_durations_cont_reference(copies.pop(), time_step), repeats)
+
+    return {'case': 'extract_notes_and_durations_cont', 'num_notes': num_notes,
+            'fast_s': t_fast, 'reference_s': t_ref, 'speedup': t_ref / t_fast}
+
+
+def score_signature(score):
+    """
+    Comparable summary of a score: (offset, quarterLength, name) per element.
+    """
+    return [[(el.offset, el.quarterLength, 'rest' if el.isRest else el.nameWithOctave)
+             for el in part.notesAndRests]
+            for part in score.parts]
+
+
+def bench_reconstruct_score_cont(num_notes=200, time_step=0.25, repeats=5):
+    """
+    Time the vectorized decoder against the reference on one synthetic
+    token sequence and check both build identical scores.
+    """
+    note_dict, _, _, _ = util.extract_notes_and_durations_cont(
+        synthetic_score(num_notes), time_step)
+
+    fast = util.reconstruct_score_cont(note_dict, time_step)
+    ref = reconstruct_score_cont_reference(note_dict, time_step)
+    assert score_signature(fast) == score_signature(ref), \
+        'fast decoder output differs from reference'
+
+    t_fast = best_time(lambda: util.reconstruct_score_cont(note_dict, time_step), repeats)
+    t_ref = best_time(lambda: reconstruct_score_cont_reference(note_dict, time_step), repeats)
+
+    return {'case': 'reconstruct_score_cont', 'num_notes': num_notes,
+            'fast_s': t_fast, 'reference_s': t_ref, 'speedup': t_ref / t_fast}
+
+
+# Pipeline suite. Each case builds its inputs outside the timed region and
+# returns the best time over `repeats` runs and the number of items it handled.
+
+def synthetic_tokens(num_notes=200, time_step=0.25, seed=0):
+    """
+    'cont' token dict of a synthetic score, and the vocabulary that
+    create_dataset.py builds (ntoi, with '.' = 0 and 'rest' = 1).
+    """
+    note_dict, _, _, _ = util.extract_notes_and_durations_cont(
+        synthetic_score(num_notes, seed), time_step)
+    # Random parts differ in length; pad with rests like a real SATB piece
+    length = max(len(tokens) for tokens in note_dict.values())
+    note_dict = {part: tokens + ['rest'] * (length - len(tokens))
+                 for part, tokens in note_dict.items()}
+    return note_dict, dict(vocab.NTOI)
+
+
+def synthetic_windows(num_notes=200, sequence_length=8, seed=0):
+    import model
+    note_dict, ntoi = synthetic_tokens(num_notes, seed=seed)
+    encoded = {part: [ntoi[s] for s in tokens] for part, tokens in note_dict.items()}
+    zeros = {part: [0] * len(tokens) for part, tokens in encoded.items()}
+    return model.create_multivoice_training_data(encoded, zeros, sequence_length), ntoi
+
+
+def case_extract(size, repeats):
+    score = synthetic_score(size)
+    return best_time(lambda: util.extract_notes_and_durations_cont(score), repeats), 4 * size
+
+
+def case_encode_sequences(size, repeats):
+    note_dict, duration_dict = synthetic_dicts(size)
+    return best_time(lambda: util.encode_sequences(note_dict, duration_dict), repeats), 4 * size
+
+
+def case_reconstruct(size, repeats):
+    note_dict, _ = synthetic_tokens(size)
+    t = best_time(lambda: util.reconstruct_score_cont(note_dict), repeats)
+    return t, sum(len(tokens) for tokens in note_dict.values())
+
+
+def case_training_windows(size, repeats):
+    import model
+    note_dict, ntoi = synthetic_tokens(size)
+    encoded = {part: [ntoi[s] for s in tokens] for part, tokens in note_dict.items()}
+    zeros = {part: [0] * len(tokens) for part, tokens in encoded.items()}
+    t = best_time(lambda: model.create_multivoice_training_data(encoded, zeros, 8), repeats)
+    return t, len(next(iter(encoded.values()))) - 8
+
+
+def case_train_step(size, repeats, batch_size=256):
+    # One full-batch train_model epoch (one optimizer step) on batch_size windows
+    import model
+    (Xn, Xd, yn, yd), ntoi = synthetic_windows(size)
+    Xn, Xd, yn, yd = Xn[:batch_size], Xd[:batch_size], yn[:batch_size], yd[:batch_size]
+    torch.manual_seed(0)
+    net = model.MultiPartGenerator(len(ntoi), 1)
+    with contextlib.redirect_stdout(None):
+        t = best_time(lambda: model.train_model(net, Xn, Xd, yn, yd, epochs=1), repeats)
+    return t, len(Xn)
+
+
+def case_predict_next(size, repeats, calls=100):
+    # predict_next_all_parts on `calls` consecutive windows
+    import model
+    (Xn, Xd, _, _), ntoi = synthetic_windows(size)
+    torch.manual_seed(0)
+    net = model.MultiPartGenerator(len(ntoi), 1)
+    windows = [(Xn[i], Xd[i]) for i in range(min(calls, len(Xn)))]
+
+    def run():
+        for notes, durs in windows:
+            model.predict_next_all_parts(net, notes, durs)
+    return best_time(run, repeats), len(windows)
+
+
+def case_bigram(size, repeats, num_samples=100):
+    # Bigram counts on a packed store, then sampling as in create_dataset.py
+    import markov
+    import token_store
+    note_dict, ntoi = synthetic_tokens(size)
+    iton = {i: name for name, i in ntoi.items()}
+    chorale = {part.capitalize(): [0] + [ntoi[s] for s in tokens] + [0]
+               for part, tokens in note_dict.items()}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = token_store.pack_corpus([chorale], tmp, vocab=[iton[i] for i in range(len(iton))])
+
+        def run():
+            counts = markov.bigram_counts(store)
+            markov.AliasSampler(counts[0]).sample(num_samples, max_length=1000, seed=0)
+        t = best_time(run, repeats)
+        del store
+    return t, len(chorale['Soprano'])
+
+
+CASES = {
+    'extract_notes_and_durations_cont': case_extract,
+    'encode_sequences': case_encode_sequences,
+    'reconstruct_score_cont': case_reconstruct,
+    'create_multivoice_training_data': case_training_windows,
+    'train_model_step': case_train_step,
+    'predict_next_all_parts': case_predict_next,
+    'bigram_build_and_sample': case_bigram,
+}
+
+# Allowed slowdown against the baseline (current / baseline time) before a
+# case counts as a regression; noisy cases get more slack
+DEFAULT_THRESHOLD = 1.25
+THRESHOLDS = {'train_model_step': 1.5, 'predict_next_all_parts': 1.5}
+
+
+def run_suite(sizes=(100, 1000, 5000), repeats=5, cases=None):
+    """
+    Run the pipeline cases at every input size.
+
+    Args:
+        sizes (list): Notes per part of the synthetic inputs.
+        repeats (int): Runs per case; the best time is kept.
+        cases (list): Case names to run (default: all of CASES).
+
+    Returns:
+        dict: 'meta' (environment and settings) and 'results', one row per
+            (case, size) with the best time in seconds and items per second.
+    """
+    results = []
+    for name in cases or CASES:
+        for size in sizes:
+            seconds, items = CASES[name](size, repeats)
+            results.append({'case': name, 'size': size, 'seconds': seconds,
+                            'items': items, 'items_per_s': items / seconds})
+            print(f"{name:34s} size={size:<6d} {seconds * 1e3:10.2f} ms "
+                  f"{items / seconds:14.0f} items/s")
+
+    meta = {'python': platform.python_version(), 'numpy': np.__version__,
+            'torch': torch.__version__, 'platform': platform.platform(),
+            'sizes': list(sizes), 'repeats': repeats,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    return {'meta': meta, 'results': results}
+
+
+def check_regressions(report, baseline, thresholds=None):
+    """
+    Compare a run_suite report with a baseline report.
+
+    Returns:
+        list: One row per (case, size) present in both, with the time ratio
+            current / baseline, the threshold and whether it regressed.
+    """
+    thresholds = {**THRESHOLDS, **(thresholds or {})}
+    reference = {(r['case'], r['size']): r['seconds'] for r in baseline['results']}
+    rows = []
+    for r in report['results']:
+        key = (r['case'], r['size'])
+        if key not in reference:
+            continue
+        ratio = r['seconds'] / reference[key]
+        limit = thresholds.get(r['case'], DEFAULT_THRESHOLD)
+        rows.append({'case': r['case'], 'size': r['size'], 'ratio': ratio,
+                     'threshold': limit, 'regression': ratio > limit})
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pipeline benchmarks')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), default=None)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', default='benchmarks_baseline.json')
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--reference', action='store_true',
+                        help='also time the fast paths against the reference implementations')
+    args = parser.parse_args()
+
+    torch.set_num_threads(1)
+    report = run_suite(args.sizes, args.repeats, args.cases)
+
+    if args.reference:
+        report['reference'] = []
+        for num_notes in args.sizes:
+            report['reference'].append(bench_extract_notes_and_durations_cont(num_notes))
+            report['reference'].append(bench_reconstruct_score_cont(num_notes))
+            print(report['reference'][-2])
+            print(report['reference'][-1])
+
+    failed = False
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            report['regressions'] = check_regressions(report, json.load(f))
+        for row in report['regressions']:
+            if row['regression']:
+                failed = True
+                print(f"REGRESSION {row['case']} size={row['size']}: "
+                      f"{row['ratio']:.2f}x baseline (limit {row['threshold']:.2f}x)")
+    else:
+        # Baselines are machine specific, so none is committed; say so rather
+        # than exit 0 as if the check had passed
+        report['regressions'] = None
+        print(f"No baseline at {args.baseline}, regression check skipped "
+              f"(write one on this machine with --save-baseline)")
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,199 @@
+"""
+Persistent metadata index of corpus files, so that ingestion only parses
+files that can be used.
+
+For every file it records the title, part names, part count, number of
+measures, quarterLength, shortest note, key and time signature (see
+ingest.score_metadata). The index is saved as JSON, keyed by path
+relative to the music21 corpus (so it does not depend on where music21
+is installed) together with each file's mtime and size.
+
+The metadata comes from the parse that ingestion does anyway: files the
+index does not know yet are ingested, and add_entries folds their
+metadata in, so a build opens each file at most once. update() parses
+files on its own, for use without ingestion.
+"""
+import os
+import json
+
+import ingest
+
+INDEX_VERSION = 2
+
+
+def file_metadata(path):
+    """
+    Metadata row for one corpus file (see ingest.score_metadata). Parses
+    the file; files that fail to parse get an 'error' instead.
+    """
+    from music21 import corpus
+
+    try:
+        return ingest.score_metadata(corpus.parse(str(path)))
+    except Exception as e:
+        return {'error': f"{type(e).__name__}: {e}"}
+
+
+def _stamp(path):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+class CorpusIndex:
+    """
+    Metadata for many corpus files, loaded from and saved to a JSON file.
+
+    Typical use, filling the index during ingestion:
+
+        index = CorpusIndex('corpus_index.json')
+        paths = index.query(paths, required_parts=['Soprano', 'Alto',
+                                                   'Tenor', 'Bass'],
+                            min_dur=0.25, include_unindexed=True)
+        entries = ingest.ingest_corpus(paths, ...)
+        index.add_entries(paths, entries)
+    """
+
+    def __init__(self, path='corpus_index.json', root=None):
+        self.path = path
+        if root is None:
+            from music21 import common
+            root = str(common.getCorpusFilePath())
+        self.root = os.path.abspath(root)
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            if data.get('version') == INDEX_VERSION:
+                self.entries = data['entries']
+
+    def key(self, path):
+        path = os.path.abspath(str(path))
+        rel = os.path.relpath(path, self.root)
+        if rel.startswith('..'):
+            rel = path
+        return rel.replace(os.sep, '/')
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, path):
+        return self.key(path) in self.entries
+
+    def get(self, path):
+        return self.entries.get(self.key(path))
+
+    def stale(self, paths):
+        """
+        Paths that are not indexed yet or changed since they were.
+        """
+        todo = []
+        for path in paths:
+            entry = self.entries.get(self.key(path))
+            if entry is None or tuple(entry['stamp']) != _stamp(path):
+                todo.append(path)
+        return todo
+
+    def record(self, path, row):
+        self.entries[self.key(path)] = {**row, 'stamp': list(_stamp(path))}
+
+    def add_entries(self, paths, entries, save=True):
+        """
+        Fold the metadata of ingest_corpus entries into the index. Entries
+        of files that failed to parse are recorded with their 'error'.
+
+        Returns:
+            int: Number of files added or refreshed.
+        """
+        todo = set(map(str, self.stale(paths)))
+        for path, entry in zip(paths, entries):
+            if str(path) not in todo:
+                continue
+            if entry.get('metadata') is not None:
+                self.record(path, entry['metadata'])
+            elif entry['status'] == 'error':
+                self.record(path, {'error': entry['error']})
+        if todo and save:
+            self.save()
+        return len(todo)
+
+    def update(self, paths, workers=None, save=True):
+        """
+        Parse and index new and changed files, in a process pool when
+        workers > 1.
+
+        Files that fail to parse are recorded with an 'error' and never
+        match a query.
+
+        Returns:
+            int: Number of files parsed.
+        """
+        todo = self.stale(paths)
+        rows = ingest.run_pool(file_metadata, [str(p) for p in todo], workers)
+        for path, row in zip(todo, rows):
+            self.record(path, row)
+        if todo and save:
+            self.save()
+        return len(todo)
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': INDEX_VERSION, 'entries': self.entries}, f)
+        os.replace(tmp_path, self.path)
+
+    def query(self, paths=None, required_parts=None, min_dur=None, num_parts=None,
+              time_signature=None, key=None, where=None, include_unindexed=False):
+        """
+        Indexed files that pass every given condition.
+
+        Args:
+            paths (list): Files to filter, returned in this order (default:
+                every indexed file, as absolute paths). Files that are not
+                indexed never pass, unless include_unindexed.
+            required_parts (list): Part names that must all be present.
+            min_dur (float): Lower bound on the shortest note, e.g. the
+                time_step the files will be tokenized at.
+            num_parts (int): Exact number of parts.
+            time_signature (str): e.g. '4/4'.
+            key (str): e.g. 'G minor'.
+            where (callable): Extra test on the metadata dict.
+            include_unindexed (bool): Also pass files that are not indexed
+                or changed since, e.g. to ingest them and add their entries.
+
+        Returns:
+            list: The paths that pass.
+        """
+        if paths is None:
+            paths = [k if os.path.isabs(k) else os.path.join(self.root, k)
+                     for k in self.entries]
+
+        unindexed = set(map(str, self.stale(paths))) if include_unindexed else ()
+        selected = []
+        for path in paths:
+            if str(path) in unindexed:
+                selected.append(path)
+                continue
+            m = self.entries.get(self.key(path))
+            if m is None or 'error' in m:
+                continue
+            if required_parts and not all(p in m['part_names'] for p in required_parts):
+                continue
+            if min_dur is not None and (m['min_dur'] is None or m['min_dur'] < min_dur):
+                continue
+            if num_parts is not None and m['num_parts'] != num_parts:
+                continue
+            if time_signature is not None and m['time_signature'] != time_signature:
+                continue
+            if key is not None and m['key'] != key:
+                continue
+            if where is not None and not where(m):
+                continue
+            selected.append(path)
+        return selected
+
+    def rows(self):
+        """
+        One flat dict per file, e.g. for pandas.DataFrame.
+        """
+        return [{'file': k, **{f: v for f, v in m.items() if f != 'stamp'}}
+                for k, m in self.entries.items()]
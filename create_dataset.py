@@ -1,7 +1,6 @@
 import os
 import sys
 import random
-import torch
 import numpy as np
 import pandas as pd
 from tqdm import tqdm
@@ -9,45 +8,59 @@ from tqdm import tqdm
 from music21 import corpus
 
 import util
+import vocab
+import ingest
+import corpus_index
+import token_store
+import midi_writer
+import augment
+import markov
+import profiling
 
 #%% Paramters
 time_step = 0.25
-notes_vocab = util.get_normalized_note_names(low='C2', high='C6')
+
+# Every file is parsed once and tokenized at all of these time steps; the
+# store for time_step is store_dir, the others get the time step appended
+resolutions = [0.125, 0.25, 0.5]
+cache_dir = '.token_cache'
+index_path = 'corpus_index.json'
+store_dir = 'bach_tokens'
+
+# Also pack every transposition that stays in the vocabulary range (see
+# augment.py); training can instead transpose lazily with
+# StreamingWindows(store, transform=augment.RandomTransposition(store.vocab))
+transpose = False
+transposed_dir = 'bach_tokens_transposed'
+sample_midi = 'sampled_chorale.mid'
+joint_midi = 'sampled_satb_chorale.mid'
+bigram_path = os.path.join(store_dir, 'bigrams.npz')
+
+# Sampling: number of pieces drawn per batch, and RNG seed (None = random)
+n_samples = 1
+seed = None
+
+# Worker processes for corpus ingestion (None = all cores). Windows spawns
+# workers, which re-run this unguarded script (from the command line, runfile
+# or cells alike), so ingestion stays in this process there.
+n_workers = 1 if os.name == 'nt' else None
+
+# Stage timings and counters, written as a JSON summary and a Chrome trace
+profile = False
+profile_summary = 'profile_summary.json'
+profile_trace = 'profile_trace.json'
+if profile:
+    profiling.enable()
+
+notes_vocab = vocab.NOTES_VOCAB
 n_vocab = len(notes_vocab)
 
 #%% All Bach Compositions summary
 # paths = corpus.getComposer('bach')
 
-# filepath = []
-# title = []
-# quarterlength = []
-# time_signature = []
-# measures = []
-# parts = []
-# offsets = []
-
-# for path in tqdm(paths):
-   
-#     sBach = corpus.parse(str(path))
-   
-#     filepath.append(str(path))
-   
-#     title.append(sBach.getElementsByClass('Metadata')[0].title)
-#     offsets.append(sBach.getElementsByClass('Metadata')[0].offset)
-   
-#     quarterlength.append(sBach.quarterLength)
-   
-#     measures.append(len(sBach.parts[0].getElementsByClass('Measure')))
-#     parts.append(len(sBach.parts))
-   
-   
-# summary_df = pd.DataFrame()
-# summary_df['filepath'] = filepath
-# summary_df['title'] = title
-# summary_df['quarterlength'] = quarterlength
-# summary_df['measures'] = measures
-# summary_df['parts'] = parts
-# summary_df['offsets'] = offsets
+# corpus_idx = corpus_index.CorpusIndex(index_path)
+# corpus_idx.update(paths, workers=n_workers)
+# summary_df = pd.DataFrame(corpus_idx.rows())
 
 # summary_df.to_csv(r"bach_summary.csv")
 
@@ -96,113 +109,153 @@ n_vocab = len(notes_vocab)
 
 #%% All Bach Compositions encoded notes
 
-# note to index
-ntoi = {}
-ntoi = {notes_vocab[i]:i+2 for i in range(len(notes_vocab))}
-ntoi['.'] = 0
-ntoi['rest'] = 1
+# note to index ('.' = 0, 'rest' = 1, then notes_vocab)
+ntoi = dict(vocab.NTOI)
 
 # index to note
-iton = {value:key for key, value in ntoi.items()}
+iton = dict(vocab.ITON)
 
 # Get all bach chorales with four parts
 paths = corpus.getComposer('bach')
 chorale_parts = ['Soprano', 'Alto', 'Tenor', 'Bass']
+resolutions = sorted(set(resolutions) | {time_step})
 all_bachs = {}
 
+# Indexed files without all four parts or with notes shorter than the
+# finest resolution are skipped unopened; new or changed files are
+# ingested, and their metadata is indexed from that same parse
+corpus_idx = corpus_index.CorpusIndex(index_path)
+all_paths = paths
+paths = corpus_idx.query(all_paths, required_parts=chorale_parts, min_dur=min(resolutions),
+                         include_unindexed=True)
+
+# Tokenized files are cached on disk, so warm runs skip music21 parsing
+token_cache = ingest.TokenCache(cache_dir)
+
 # paths = [r'C:/Users/14694/.pyenv/pyenv-win/versions/3.9.13/Lib/site-packages/music21/corpus/bach/bwv299.mxl']
 
-for i, path in enumerate(paths):
-    
-    sBach = corpus.parse(str(path))
-    sBach_parts = [s.partName for s in sBach.parts]
+# Parse and tokenize in parallel; the workers still check the parts and
+# min_dur of each resolution
+with profiling.span('ingest'):
+    entries = ingest.ingest_corpus(paths, time_step=resolutions,
+                                   required_parts=chorale_parts,
+                                   cache=token_cache, workers=n_workers)
+
+for i, entry in enumerate(entries):
     
-    has_parts = [s in sBach_parts for s in chorale_parts]
+    if entry['status'] == 'error':
+        print(f"Skipping {paths[i]}: {entry['error']}")
+        continue
     
-    if all(has_parts):
+    if entry['status'] == 'ok':
         
-        # Extract all part notes and convert durations to 0.125
-        note_dict, duration_dict, part_duration, min_dur = \
-                    util.extract_notes_and_durations_cont(sBach, time_step=time_step)
-                    
-        # Skip if time_step is larger than minimum duration
-        if min_dur < time_step:
-            continue
+        # SATB parts only, as integer (pitch, onset) tokens, one grid per
+        # resolution the piece is fine enough for
+        grids = entry['tokens']
         
-        # Take only SATB parts
-        note_dict = {key: note_dict[key] for key in chorale_parts}
+        # Reconstruct the score back from the tokens
+        # sBach_recon = grids[time_step].to_score()
         
-        # Reconstruct the score back from note_dict
-        # sBach_recon = util.reconstruct_score_cont(note_dict)
-        
-        # Make sure all parts have same length of 0.125 durations
-        first_length = len(next(iter(note_dict.values())))
-        assert all(len(lst) == first_length for lst in note_dict.values()) 
+        # Make sure all parts have same length of time_step durations
+        for chorale in grids.values():
+            assert len(set(chorale.part_lengths().values())) == 1
                 
         all_bachs[i] = {}
-        all_bachs[i]['note_dict'] = note_dict
-
-# Convert notes in dictionary to indices
-soprano_all = []
-alto_all = []
-tenor_all = []
-bass_all = []
-
-for key, value in all_bachs.items():
-    
-    cur_note_dict = value['note_dict']
-    
-    soprano_cur = [ntoi[s] for s in cur_note_dict['Soprano']]
-    soprano_cur = [0] + soprano_cur + [0]
-    
-    alto_cur = [ntoi[s] for s in cur_note_dict['Alto']]
-    alto_cur = [0] + alto_cur + [0]
+        all_bachs[i]['tokens'] = grids
+
+n_indexed = corpus_idx.add_entries(paths, entries)
+print(f"Corpus index: {len(paths)} of {len(all_paths)} files ingested, {n_indexed} newly indexed")
+
+# Entries of edited files and older tokenizer versions are never hit again
+token_cache.prune()
+cache_report = token_cache.report()
+print(f"Token cache: {cache_report['hits']} hits, {cache_report['misses']} misses")
+for ts in resolutions:
+    print(f"time_step {ts}: {sum(ts in v['tokens'] for v in all_bachs.values())} chorales")
+
+# Convert tokens to vocabulary indices (one table lookup per part) and pack
+# them into one memory-mapped small-int array per voice, delimited by '.'
+# at both ends of every chorale. One store per resolution.
+token_names = [iton[i] for i in range(len(iton))]
+stores = {}
+
+for ts in resolutions:
+    keys = [key for key, value in all_bachs.items() if ts in value['tokens']]
+    encoded_all = []
     
-    tenor_cur = [ntoi[s] for s in cur_note_dict['Tenor']]
-    tenor_cur = [0] + tenor_cur + [0]
+    with profiling.span('index_conversion', time_step=ts):
+        for key in keys:
+            
+            cur_encoded = all_bachs[key]['tokens'][ts].to_indices(token_names)
+            
+            encoded_all.append({part: np.concatenate(([0], cur_encoded[part], [0]))
+                                for part in chorale_parts})
     
-    bass_cur = [ntoi[s] for s in cur_note_dict['Bass']]
-    bass_cur = [0] + bass_cur + [0]
-    
-    soprano_all.append(soprano_cur)
-    alto_all.append(alto_cur)
-    tenor_all.append(tenor_cur)
-    bass_all.append(bass_cur)
+    with profiling.span('pack_corpus', time_step=ts):
+        stores[ts] = token_store.pack_corpus(
+            encoded_all, store_dir if ts == time_step else f"{store_dir}_{ts:g}",
+            vocab=token_names,
+            keys=[paths[key] for key in keys],
+            voices=chorale_parts)
+    del encoded_all
+
+store = stores[time_step]
+profiling.count('chorales_kept', len(store))
+profiling.count('tokens', store.tokens.size)
+
+#%% Transposition augmentation
+
+if transpose:
+    with profiling.span('transpose'):
+        transposed = augment.transpose_store(store, transposed_dir)
+    print(f"Transposed store: {len(transposed)} chorales from {len(store)}")
 
 #%% Create parts by sampling
 
-# Soprano
-N_soprano = torch.zeros((len(ntoi), len(ntoi)), dtype=torch.int32)
-for sp_lst in soprano_all:
-    for n1, n2 in zip(sp_lst, sp_lst[1:]):
-        N_soprano[n1, n2] += 1
-
-ix = 0
-soprano_smp = []
-while True:
-    p = N_soprano[ix, :].float()
-    p = p / sum(p)
-    ix = torch.multinomial(p, num_samples=1, replacement=True).item()
-    if ix == 0:
-        break
-    soprano_smp.append(ix)
+# Bigram transition counts for all four voices in one vectorized pass
+with profiling.span('bigram_counts'):
+    N_all = markov.bigram_counts(store)
+markov.save_counts(bigram_path, N_all, store.voices, store.vocab)
+
+# Soprano: alias tables are built once, then whole batches of sequences
+# are drawn in lock-step until they hit the '.' terminator
+with profiling.span('bigram_sampling'):
+    soprano_sampler = markov.AliasSampler(N_all[store.voices.index('Soprano')])
+    soprano_smps, soprano_lens = soprano_sampler.sample(n_samples, seed=seed)
+soprano_smp = soprano_smps[0, :soprano_lens[0]].tolist()
 
 # # Alto
-# N_alto = torch.zeros((len(ntoi), len(ntoi)), dtype=torch.int32)
-# for sp_lst in soprano_all:
-#     for n1, n2 in zip(sp_lst, sp_lst[1:]):
-#         N_alto[n1, n2] += 1
-
-# ix = 0
-# alto_smp = []
-# while True:
-#     p = N_alto[ix, :].float()
-#     p = p / sum(p)
-#     ix = torch.multinomial(p, num_samples=1, replacement=True).item()
-#     alto_smp.append(ix)
+# alto_sampler = markov.AliasSampler(N_all[store.voices.index('Alto')])
+# alto_smps, alto_lens = alto_sampler.sample(n_samples, seed=seed)
+# alto_smp = alto_smps[0, :alto_lens[0]].tolist()
     
 # Convert back to note_dict
 notes_dict_sampled = {'Soprano' : [iton[s] for s in soprano_smp],
                       }
-sBach_smp = util.reconstruct_score_cont(notes_dict_sampled)
-sBach_smp.show('midi')
\ No newline at end of file
+
+# Write the sample straight to MIDI, without building a music21 Score
+with open(sample_midi, 'wb') as f:
+    f.write(midi_writer.note_dict_to_midi(notes_dict_sampled, time_step=time_step))
+
+# Play in a media player
+# sBach_smp = util.reconstruct_score_cont(notes_dict_sampled)
+# sBach_smp.show('midi')
+
+#%% Sample all four voices jointly
+
+# The state is the SATB tuple of token indices, so voices share harmony
+with profiling.span('joint_chain'):
+    joint_chain = markov.JointChain(store)
+    satb_smps, satb_lens = joint_chain.sample(n_samples, seed=seed)
+satb_smp = satb_smps[0, :satb_lens[0]]
+
+with open(joint_midi, 'wb') as f:
+    f.write(midi_writer.encoded_to_midi(
+        {voice: satb_smp[:, v] for v, voice in enumerate(store.voices)},
+        iton, time_step=time_step))
+
+#%% Profile report
+if profile:
+    profiling.write_summary(profile_summary)
+    profiling.write_chrome_trace(profile_trace)
+    print(f"Profile written to {profile_summary} and {profile_trace}")
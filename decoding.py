@@ -0,0 +1,147 @@
+"""
+Batched decoding strategies for MultiPartGenerator: temperature, top-k
+and nucleus sampling, and beam search over all part heads at once.
+"""
+import torch
+import torch.nn.functional as F
+
+
+def filter_logits(logits, top_k=None, top_p=None):
+    """
+    Mask logits outside the top-k and/or the top-p nucleus with -inf.
+
+    Args:
+        logits (torch.Tensor): (..., V) logits.
+        top_k (int): Keep the k largest logits.
+        top_p (float): Keep the smallest set of tokens whose probability
+            mass reaches top_p (the most likely token is always kept).
+
+    Returns:
+        torch.Tensor: Filtered copy of logits.
+    """
+    logits = logits.clone()
+    if top_k is not None and top_k < logits.shape[-1]:
+        kth = logits.topk(top_k, dim=-1).values[..., -1:]
+        logits[logits < kth] = float('-inf')
+
+    if top_p is not None and top_p < 1.:
+        sorted_logits, order = logits.sort(dim=-1, descending=True)
+        cum_probs = sorted_logits.softmax(dim=-1).cumsum(dim=-1)
+        # Drop a token once the mass before it already reaches top_p
+        drop = cum_probs - sorted_logits.softmax(dim=-1) >= top_p
+        logits.scatter_(-1, order, sorted_logits.masked_fill(drop, float('-inf')))
+    return logits
+
+
+def sample_logits(logits, temperature=1., top_k=None, top_p=None, generator=None):
+    """
+    Draw one index per row of (..., V) logits; temperature 0 is argmax.
+    """
+    if temperature == 0:
+        return logits.argmax(dim=-1)
+    probs = filter_logits(logits / temperature, top_k, top_p).softmax(dim=-1)
+    flat = torch.multinomial(probs.reshape(-1, probs.shape[-1]), 1, generator=generator)
+    return flat.view(probs.shape[:-1])
+
+
+def sampler(temperature=1., top_k=None, top_p=None, generator=None):
+    """
+    A select function for MultiPartGenerator.generate that samples notes and
+    durations for every sequence and part in one call.
+    """
+    def select(note_logits, dur_logits):
+        return (sample_logits(note_logits, temperature, top_k, top_p, generator),
+                sample_logits(dur_logits, temperature, top_k, top_p, generator))
+    return select
+
+
+def _joint_topk(log_probs, k):
+    """
+    The k best joint choices over independent factors.
+
+    Args:
+        log_probs (list): F tensors of shape (N, V_f), one per factor.
+        k (int): Number of joint candidates to keep.
+
+    Returns:
+        scores (torch.Tensor): (N, k') summed log-probabilities, best first.
+        choices (torch.Tensor): (N, k', F) index chosen for each factor.
+    """
+    scores, first = log_probs[0].topk(min(k, log_probs[0].shape[-1]), dim=-1)
+    choices = first.unsqueeze(-1)
+    for lp in log_probs[1:]:
+        top, idx = lp.topk(min(k, lp.shape[-1]), dim=-1)           # (N, kf)
+        combined = (scores.unsqueeze(-1) + top.unsqueeze(1)).flatten(1)
+        scores, flat = combined.topk(min(k, combined.shape[-1]), dim=-1)
+        parent, pick = flat // top.shape[-1], flat % top.shape[-1]
+        choices = torch.cat([
+            choices.gather(1, parent.unsqueeze(-1).expand(-1, -1, choices.shape[-1])),
+            idx.gather(1, pick).unsqueeze(-1)], dim=-1)
+    return scores, choices
+
+
+@torch.no_grad()
+def beam_search(model, notes_seed, durs_seed, steps, beam_width=8):
+    """
+    Beam search over whole timesteps (all parts' notes and durations).
+
+    The part heads are independent given the LSTM state, so the best joint
+    candidates per beam come from combining per-head top-k lists. Beams
+    are scored, pruned and reordered with tensor ops, and the LSTM state
+    is carried forward, so each step is one forward call over all
+    batch x beam sequences.
+
+    Args:
+        model (MultiPartGenerator): Trained model.
+        notes_seed, durs_seed (torch.Tensor): (B, T, 4) or (T, 4) seeds.
+        steps (int): Number of timesteps to generate.
+        beam_width (int): Beams kept per seed.
+
+    Returns:
+        notes (torch.Tensor): (B, beam_width, steps, 4), best beam first.
+        durs (torch.Tensor): (B, beam_width, steps, 4).
+        scores (torch.Tensor): (B, beam_width) total log-probabilities.
+    """
+    if notes_seed.dim() == 2:
+        notes_seed, durs_seed = notes_seed.unsqueeze(0), durs_seed.unsqueeze(0)
+    B, W, P = notes_seed.shape[0], beam_width, model.num_parts
+
+    was_training = model.training
+    model.eval()
+    try:
+        note_logits, dur_logits, (h, c) = model.step(notes_seed, durs_seed)
+
+        # Every beam starts from its seed; only beam 0 is live at first,
+        # so the first step does not pick the same candidate W times
+        note_logits = note_logits.repeat_interleave(W, dim=0)
+        dur_logits = dur_logits.repeat_interleave(W, dim=0)
+        h, c = h.repeat_interleave(W, dim=1), c.repeat_interleave(W, dim=1)
+        scores = torch.full((B, W), float('-inf'))
+        scores[:, 0] = 0.
+
+        notes = torch.zeros(B * W, 0, P, dtype=torch.long)
+        durs = torch.zeros(B * W, 0, P, dtype=torch.long)
+        batch_offset = (torch.arange(B) * W).unsqueeze(1)
+
+        for _ in range(steps):
+            note_lp = F.log_softmax(note_logits, dim=-1)
+            dur_lp = F.log_softmax(dur_logits, dim=-1)
+            factors = [note_lp[:, p] for p in range(P)] + [dur_lp[:, p] for p in range(P)]
+            cand_scores, choices = _joint_topk(factors, W)       # (B*W, K), (B*W, K, 2P)
+            K = cand_scores.shape[1]
+
+            total = (scores.view(-1, 1) + cand_scores).view(B, W * K)
+            scores, flat = total.topk(W, dim=-1)                 # (B, W)
+            rows = (batch_offset + flat // K).view(-1)           # surviving parent beams
+            picked = choices[rows, (flat % K).view(-1)]          # (B*W, 2P)
+
+            notes = torch.cat([notes[rows], picked[:, None, :P]], dim=1)
+            durs = torch.cat([durs[rows], picked[:, None, P:]], dim=1)
+            h, c = h[:, rows], c[:, rows]
+
+            note_logits, dur_logits, (h, c) = model.step(
+                picked[:, None, :P], picked[:, None, P:], (h, c))
+    finally:
+        model.train(was_training)
+
+    return notes.view(B, W, steps, P), durs.view(B, W, steps, P), scores
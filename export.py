@@ -0,0 +1,123 @@
+"""
+CPU inference artifact for MultiPartGenerator: dynamic int8 quantization
+of the LSTM and output Linears, saved as TorchScript so it loads with
+torch.jit.load and no model code.
+"""
+import copy
+import time
+
+import torch
+import torch.nn as nn
+from torch.ao.quantization import quantize_dynamic
+
+
+def quantize(model):
+    """
+    Copy of model with int8 weights for the LSTM and the Linear heads.
+    Activations are quantized on the fly; the embeddings stay fp32.
+    """
+    model = copy.deepcopy(model).eval()
+    return quantize_dynamic(model, {nn.LSTM, nn.Linear}, dtype=torch.qint8)
+
+
+def export_torchscript(model, path, sequence_length=8, quantized=True):
+    """
+    Trace model (quantized first, by default) and save it to path.
+
+    The artifact has two methods, matching MultiPartGenerator:
+    forward(notes, durs) -> (note_logits, dur_logits) and
+    step(notes, durs, (h, c)) -> (note_logits, dur_logits, (h, c)), both
+    for (B, T, num_parts) index tensors of any B and T.
+
+    Returns:
+        torch.jit.ScriptModule: The traced module.
+    """
+    model = quantize(model) if quantized else copy.deepcopy(model).eval()
+    P, H = model.num_parts, model.lstm.hidden_size
+
+    notes = torch.zeros(2, sequence_length, P, dtype=torch.long)
+    durs = torch.zeros(2, sequence_length, P, dtype=torch.long)
+    state = (torch.zeros(1, 2, H), torch.zeros(1, 2, H))
+    with torch.no_grad():
+        scripted = torch.jit.trace_module(
+            model, {'forward': (notes, durs), 'step': (notes, durs, state)})
+    scripted.save(path)
+    return scripted
+
+
+def load(path):
+    return torch.jit.load(path, map_location='cpu')
+
+
+def _time_calls(fn, repeats):
+    fn()
+    t0 = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - t0) / repeats
+
+
+def compare(eager, exported, notes, durs, batch_sizes=(1, 64, 512), repeats=20):
+    """
+    Latency, throughput and top-1 agreement of an exported model against
+    the eager fp32 one, on windows notes/durs of shape (N, T, num_parts).
+
+    Returns:
+        dict: 'note_top1_agreement' and 'dur_top1_agreement' (fraction of
+            (window, part) pairs with the same argmax over all N windows),
+            and per batch size the eager and exported latency (ms per call),
+            throughput (windows/sec) and speedup.
+    """
+    was_training = eager.training
+    eager.eval()
+    try:
+        with torch.no_grad():
+            ref_notes, ref_durs = eager(notes, durs)
+            out_notes, out_durs = exported(notes, durs)
+        report = {
+            'windows': len(notes),
+            'note_top1_agreement':
+                (ref_notes.argmax(-1) == out_notes.argmax(-1)).float().mean().item(),
+            'dur_top1_agreement':
+                (ref_durs.argmax(-1) == out_durs.argmax(-1)).float().mean().item(),
+            'batches': [],
+        }
+
+        with torch.no_grad():
+            for b in batch_sizes:
+                Xn, Xd = notes[:b], durs[:b]
+                eager_s = _time_calls(lambda: eager(Xn, Xd), repeats)
+                export_s = _time_calls(lambda: exported(Xn, Xd), repeats)
+                report['batches'].append({
+                    'batch_size': len(Xn),
+                    'eager_ms': eager_s * 1e3,
+                    'exported_ms': export_s * 1e3,
+                    'eager_windows_per_s': len(Xn) / eager_s,
+                    'exported_windows_per_s': len(Xn) / export_s,
+                    'speedup': eager_s / export_s,
+                })
+    finally:
+        eager.train(was_training)
+    return report
+
+
+if __name__ == '__main__':
+    import os
+    import json
+    import model as mdl
+    import token_store
+
+    torch.set_num_threads(1)
+    store = token_store.TokenStore('bach_tokens')
+    net = mdl.MultiPartGenerator(len(store.vocab), 1)
+    if os.path.exists('multipart_generator.pt'):
+        net.load_state_dict(torch.load('multipart_generator.pt')['model'])
+
+    # Evaluation windows from the corpus
+    dataset = mdl.StreamingWindows(store, sequence_length=8, shuffle_buffer=10000)
+    loader = torch.utils.data.DataLoader(dataset, batch_size=2048)
+    Xn, Xd, _, _ = next(iter(loader))
+
+    scripted = export_torchscript(net, 'multipart_generator_int8.pt')
+    report = compare(net, load('multipart_generator_int8.pt'), Xn, Xd)
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,325 @@
+import os
+import pickle
+import hashlib
+
+import util
+import tokens
+import profiling
+
+# Bump whenever tokenize_file or tokens.extract_chorale_tokens
+# changes its output, so stale cache entries are never reused.
+TOKENIZER_VERSION = 4
+
+
+class TokenCache:
+    """
+    On-disk cache of per-file tokenizer output.
+
+    Entries are keyed by absolute file path, file mtime and size, time_step,
+    the required part names and TOKENIZER_VERSION, so new or edited files
+    (and tokenizer changes) miss the cache and everything else is loaded
+    without touching music21. Superseded entries are removed by prune().
+    """
+
+    def __init__(self, cache_dir='.token_cache'):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.hits = []
+        self.misses = []
+        # Keys looked up or written since the cache was opened
+        self.used = set()
+
+    def key(self, path, time_step, required_parts=None):
+        st = os.stat(path)
+        parts = ','.join(required_parts or [])
+        if isinstance(time_step, (list, tuple)):
+            time_step = list(time_step)
+        raw = (f"{os.path.abspath(path)}|{st.st_mtime_ns}|{st.st_size}|"
+               f"{time_step}|{parts}|{TOKENIZER_VERSION}")
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key + '.pkl')
+
+    def get(self, path, time_step, required_parts=None):
+        """
+        Return the cached entry for path, or None on a miss (also when
+        path cannot be read; tokenizing it then records the error).
+        """
+        try:
+            key = self.key(path, time_step, required_parts)
+        except OSError:
+            self.misses.append(str(path))
+            return None
+        self.used.add(key)
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, 'rb') as f:
+                entry = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.misses.append(str(path))
+            return None
+        self.hits.append(str(path))
+        return entry
+
+    def put(self, path, time_step, entry, required_parts=None):
+        try:
+            key = self.key(path, time_step, required_parts)
+        except OSError:
+            # The file went away after it was tokenized; nothing to key on
+            return
+        self.used.add(key)
+        entry_path = self._entry_path(key)
+        tmp_path = entry_path + f'.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        # Atomic, so an interrupted run never leaves a truncated entry
+        os.replace(tmp_path, entry_path)
+
+    def prune(self):
+        """
+        Delete every entry not looked up or written since this cache was
+        opened: those of edited files, older TOKENIZER_VERSIONs and other
+        time_step / required_parts settings, plus leftover temporary files.
+
+        Returns:
+            int: Number of files removed.
+        """
+        removed = 0
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.pkl') and name[:-len('.pkl')] in self.used:
+                continue
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def report(self):
+        """
+        Summarize cache hits and misses since this cache was opened.
+
+        Returns:
+            dict: hits, misses, hit_rate and the list of missed paths
+        """
+        total = len(self.hits) + len(self.misses)
+        return {
+            'hits': len(self.hits),
+            'misses': len(self.misses),
+            'hit_rate': len(self.hits) / total if total else 0.,
+            'missed_paths': list(self.misses),
+        }
+
+
+def tokenize_file(path, time_step=0.25, required_parts=None):
+    """
+    Parse one corpus file and run the continuous tokenizer on it.
+
+    Files missing any of required_parts, or with notes shorter than
+    time_step, are not kept; their entry records why.
+
+    Args:
+        path (str): Path to a file music21 can parse.
+        time_step (float or list): Temporal resolution passed to the
+            tokenizer. Given several time steps, the file is parsed once and
+            tokenized at each of them.
+        required_parts (list): Part names that must all be present for the
+            file to be tokenized, e.g. ['Soprano', 'Alto', 'Tenor', 'Bass'].
+            When given, tokens only holds these parts, in this order.
+
+    Returns:
+        dict: 'status' ('ok', 'missing_parts' or 'too_fine'), 'part_names',
+        'metadata' (see score_metadata), 'tokens' (tokens.ChoraleTokens; .to_note_dict() gives the string
+        tokens), 'part_duration' and 'min_dur'. With several time steps,
+        'tokens' is {time_step: ChoraleTokens} for the time steps the file
+        is usable at, 'eligible' is {time_step: bool}, and the status is
+        'ok' if any time step is usable.
+    """
+    from music21 import corpus
+
+    multi = isinstance(time_step, (list, tuple))
+    time_steps = list(time_step) if multi else [time_step]
+
+    with profiling.span('parse', path=str(path)):
+        score = corpus.parse(str(path))
+    profiling.count('files_parsed')
+    part_names = [p.partName for p in score.parts]
+    entry = {'status': 'missing_parts',
+             'part_names': part_names,
+             'metadata': score_metadata(score),
+             'tokens': None,
+             'part_duration': None,
+             'min_dur': None}
+    if multi:
+        entry['eligible'] = {ts: False for ts in time_steps}
+
+    if required_parts and not all(s in part_names for s in required_parts):
+        return entry
+
+    # min_dur comes out of the same pass, so the 'too_fine' check is
+    # included in this span
+    with profiling.span('tokenize', path=str(path)):
+        grids, part_duration, min_dur = tokens.extract_chorale_tokens(score, time_step=time_steps)
+    entry['part_duration'] = part_duration
+    entry['min_dur'] = min_dur
+
+    # Skip time steps larger than the minimum duration
+    eligible = util.resolution_flags(min_dur, time_steps)
+    if multi:
+        entry['eligible'] = eligible
+    if not any(eligible.values()):
+        entry['status'] = 'too_fine'
+        return entry
+
+    grids = {ts: grid.select(required_parts) if required_parts else grid
+             for ts, grid in grids.items() if eligible[ts]}
+    entry['tokens'] = grids if multi else grids[time_step]
+    entry['status'] = 'ok'
+    return entry
+
+
+def load_tokens(path, time_step=0.25, required_parts=None, cache=None):
+    """
+    Tokenize one file, going through the cache when one is given.
+
+    Args:
+        path (str): Path to a corpus file.
+        time_step (float or list): Temporal resolution(s), see tokenize_file.
+        required_parts (list): See tokenize_file.
+        cache (TokenCache): Optional cache; misses are tokenized and stored.
+
+    Returns:
+        dict: Entry as returned by tokenize_file.
+    """
+    if cache is not None:
+        entry = cache.get(path, time_step, required_parts)
+        if entry is not None:
+            return entry
+
+    entry = tokenize_file(path, time_step, required_parts)
+
+    if cache is not None:
+        cache.put(path, time_step, entry, required_parts)
+    return entry
+
+
+def _tokenize_worker(args):
+    path, time_step, required_parts, profile = args
+    # Spans are recorded locally and shipped back with the entry, since a
+    # pool worker cannot write to the parent's profiler
+    with profiling.capture(profile) as prof:
+        try:
+            with profiling.span('file', path=path):
+                entry = tokenize_file(path, time_step, required_parts)
+        except Exception as e:
+            # Isolate per-file failures so one bad file cannot sink the run
+            entry = {'status': 'error', 'error': f"{type(e).__name__}: {e}"}
+    if profile:
+        entry['profile'] = prof.export()
+    return entry
+
+
+def run_pool(fn, jobs, workers):
+    """
+    Map fn over jobs, in a process pool when workers > 1.
+    Results always come back in the order of jobs.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(jobs) <= 1:
+        return [fn(job) for job in jobs]
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    # Files vary a lot in size, so hand them out one at a time
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+        return list(pool.map(fn, jobs, chunksize=1))
+
+
+def ingest_corpus(paths, time_step=0.25, required_parts=None, cache=None,
+                  workers=None):
+    """
+    Tokenize many corpus files, spreading cache misses over a process pool.
+
+    On platforms that spawn rather than fork (e.g. Windows), the calling
+    script must guard its entry point with if __name__ == '__main__', or
+    pass workers=1.
+
+    Args:
+        paths (list): Corpus file paths.
+        time_step (float or list): Temporal resolution(s), see tokenize_file.
+        required_parts (list): See tokenize_file.
+        cache (TokenCache): Optional cache, consulted before dispatching.
+        workers (int): Number of worker processes (None = all cores,
+            1 = run in this process).
+
+    Returns:
+        list: One entry per path, in the order of paths. Files that raised
+        get status 'error' and an 'error' message, and are not cached.
+    """
+    entries = [None] * len(paths)
+    todo = []
+
+    with profiling.span('cache_lookup'):
+        for i, path in enumerate(paths):
+            if cache is not None:
+                entries[i] = cache.get(path, time_step, required_parts)
+            if entries[i] is None:
+                todo.append(i)
+    profiling.count('cache_hits', len(paths) - len(todo))
+    profiling.count('cache_misses', len(todo))
+
+    jobs = [(str(paths[i]), time_step, required_parts, profiling.enabled()) for i in todo]
+    with profiling.span('tokenize_files', files=len(jobs)):
+        results = run_pool(_tokenize_worker, jobs, workers)
+
+    for i, entry in zip(todo, results):
+        profiling.profiler.merge(entry.pop('profile', None))
+        entries[i] = entry
+        if cache is not None and entry['status'] != 'error':
+            cache.put(paths[i], time_step, entry, required_parts)
+
+    for entry in entries:
+        profiling.count('files_' + entry['status'])
+    return entries
+
+
+def score_metadata(score):
+    """
+    Metadata of a parsed score, as recorded in corpus_index.CorpusIndex.
+
+    Returns:
+        dict: 'title', 'offsets', 'part_names', 'num_parts', 'measures',
+        'quarter_length', 'min_dur' (shortest quarterLength, grace notes
+        included, as in the tokenizer), 'key', 'sharps' and
+        'time_signature'.
+    """
+    from music21 import key
+
+    parts = list(score.parts)
+
+    min_dur = None
+    for part in parts:
+        for n in util.iter_notes_and_rests(part):
+            if min_dur is None or n.quarterLength < min_dur:
+                min_dur = n.quarterLength
+
+    metadata = score.metadata
+    ks = next(iter(score.recurse().getElementsByClass('KeySignature')), None)
+    ts = next(iter(score.recurse().getElementsByClass('TimeSignature')), None)
+    if ks is None:
+        key_name = None
+    else:
+        key_name = ks.name if isinstance(ks, key.Key) else ks.asKey().name
+
+    return {'title': None if metadata is None else metadata.title,
+            'offsets': None if metadata is None else float(metadata.offset),
+            'part_names': [p.partName for p in parts],
+            'num_parts': len(parts),
+            'measures': len(parts[0].getElementsByClass('Measure')) if parts else 0,
+            'quarter_length': float(score.quarterLength),
+            'min_dur': None if min_dur is None else float(min_dur),
+            'key': key_name,
+            'sharps': None if ks is None else ks.sharps,
+            'time_signature': None if ts is None else ts.ratioString}
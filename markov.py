@@ -0,0 +1,342 @@
+"""
+Markov models over the packed token corpus (see token_store).
+"""
+import numpy as np
+
+
+def _window_starts(offsets, order):
+    """
+    Start index of every window of `order` consecutive tokens that stays
+    inside one chorale.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    lengths = np.diff(offsets)
+    # End (exclusive) of the chorale each position belongs to
+    chorale_end = np.repeat(offsets[1:], lengths)
+    starts = np.arange(offsets[-1], dtype=np.int64)
+    return starts[starts + order <= chorale_end]
+
+
+def bigram_counts(store, voices=None):
+    """
+    Transition counts N[v, i, j] = number of times token j follows token i
+    in voice v, for all voices in one bincount. Pairs never cross chorales.
+
+    Args:
+        store (TokenStore): Packed corpus.
+        voices (list): Voice names to count (default: all voices).
+
+    Returns:
+        np.ndarray: int64 array of shape (num_voices, V, V).
+    """
+    voices = voices or store.voices
+    rows = [store.voices.index(v) for v in voices]
+    V = len(store.vocab)
+
+    starts = _window_starts(store.offsets, 2)
+    tokens = np.asarray(store.tokens[rows], dtype=np.int64)
+
+    # Flatten (voice, prev, next) into one index per pair
+    voice_ids = np.arange(len(rows), dtype=np.int64)[:, None]
+    flat = (voice_ids * V + tokens[:, starts]) * V + tokens[:, starts + 1]
+
+    counts = np.bincount(flat.ravel(), minlength=len(rows) * V * V)
+    return counts.reshape(len(rows), V, V)
+
+
+def ngram_counts(store, order=3, voices=None):
+    """
+    Sparse n-gram counts for every voice, for any order >= 2.
+
+    Each n-gram (t_0, ..., t_{k-1}) of voice v is packed into the integer
+    code ((v * V + t_0) * V + t_1) ... * V + t_{k-1}; only codes that occur
+    are stored, sorted, with their counts.
+
+    Args:
+        store (TokenStore): Packed corpus.
+        order (int): n-gram length k (2 = bigrams).
+        voices (list): Voice names to count (default: all voices).
+
+    Returns:
+        dict: 'order', 'vocab_size', 'voices', 'codes' and 'counts'.
+    """
+    voices = voices or store.voices
+    rows = [store.voices.index(v) for v in voices]
+    V = len(store.vocab)
+    if len(rows) * float(V) ** order >= 2 ** 63:
+        raise ValueError(f"order {order} is too large for a vocabulary of {V}")
+
+    starts = _window_starts(store.offsets, order)
+    tokens = np.asarray(store.tokens[rows], dtype=np.int64)
+
+    codes = np.broadcast_to(np.arange(len(rows), dtype=np.int64)[:, None],
+                            (len(rows), len(starts))).copy()
+    for j in range(order):
+        codes *= V
+        codes += tokens[:, starts + j]
+
+    codes, counts = np.unique(codes.ravel(), return_counts=True)
+    return {'order': order, 'vocab_size': V, 'voices': list(voices),
+            'codes': codes, 'counts': counts}
+
+
+def decode_ngrams(table):
+    """
+    Unpack the codes of an ngram_counts table.
+
+    Returns:
+        voice (np.ndarray): Voice index of each n-gram.
+        grams (np.ndarray): (num_ngrams, order) token indices.
+    """
+    V, order = table['vocab_size'], table['order']
+    codes = table['codes'].copy()
+    grams = np.empty((len(codes), order), dtype=np.int64)
+    for j in reversed(range(order)):
+        grams[:, j] = codes % V
+        codes //= V
+    return codes, grams
+
+
+def save_counts(path, counts, voices, vocab):
+    """
+    Save a bigram_counts array or an ngram_counts table to an .npz file.
+    """
+    if isinstance(counts, dict):
+        np.savez_compressed(path, codes=counts['codes'], counts=counts['counts'],
+                            order=counts['order'], voices=np.array(voices),
+                            vocab=np.array(vocab))
+    else:
+        np.savez_compressed(path, dense=counts, order=2,
+                            voices=np.array(voices), vocab=np.array(vocab))
+
+
+def load_counts(path):
+    """
+    Load tables written by save_counts.
+
+    Returns:
+        The dense bigram array or the sparse ngram table, plus the list of
+        voices and the vocabulary.
+    """
+    with np.load(path) as data:
+        voices = data['voices'].tolist()
+        vocab = data['vocab'].tolist()
+        if 'dense' in data:
+            return data['dense'], voices, vocab
+        table = {'order': int(data['order']), 'vocab_size': len(vocab),
+                 'voices': voices, 'codes': data['codes'], 'counts': data['counts']}
+        return table, voices, vocab
+
+
+def _alias_row(weights):
+    """
+    Walker/Vose alias table for one row of non-negative weights.
+
+    Returns:
+        prob (np.ndarray): Acceptance probability of each column.
+        alias (np.ndarray): Column drawn instead when not accepted.
+    """
+    n = len(weights)
+    scaled = np.asarray(weights, dtype=np.float64) * n / np.sum(weights)
+    prob = np.ones(n)
+    alias = np.arange(n)
+
+    small = [j for j in range(n) if scaled[j] < 1.]
+    large = [j for j in range(n) if scaled[j] >= 1.]
+    while small and large:
+        s, l = small.pop(), large.pop()
+        prob[s] = scaled[s]
+        alias[s] = l
+        scaled[l] -= 1. - scaled[s]
+        (small if scaled[l] < 1. else large).append(l)
+    # Whatever is left over has probability 1 up to rounding
+    return prob, alias
+
+
+def alias_tables(counts):
+    """
+    Walker/Vose alias tables for every row of a transition count matrix.
+
+    Row i can then be sampled in O(1): draw a column j uniformly and a
+    uniform u, and take j if u < prob[i, j], else alias[i, j]. Rows with
+    no counts always go to token 0, the '.' terminator.
+
+    Args:
+        counts (np.ndarray): (V, V) transition counts.
+
+    Returns:
+        prob (np.ndarray): (V, V) float64 acceptance probabilities.
+        alias (np.ndarray): (V, V) int64 alias columns.
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    prob = np.zeros(counts.shape)
+    alias = np.zeros(counts.shape, dtype=np.int64)
+
+    for i in np.flatnonzero(counts.sum(axis=1)):
+        prob[i], alias[i] = _alias_row(counts[i])
+    return prob, alias
+
+
+class AliasSampler:
+    """
+    Batched sampler for a first-order Markov chain over token indices.
+
+    Alias tables are built once; sample() then advances many independent
+    sequences in lock-step with one vectorized draw per step, dropping
+    sequences as they reach the '.' terminator (index 0).
+    """
+
+    def __init__(self, counts):
+        self.prob, self.alias = alias_tables(counts)
+        self.vocab_size = self.prob.shape[1]
+
+    def sample(self, num_sequences=1, max_length=10000, seed=None, start=0):
+        """
+        Draw num_sequences sequences, starting after token `start`.
+
+        Args:
+            num_sequences (int): Number of independent sequences.
+            max_length (int): Sequences still running after this many
+                steps are cut off.
+            seed (int): Seed for np.random.default_rng; the same seed gives
+                the same sequences.
+            start (int): Token the chains start from (default '.').
+
+        Returns:
+            tokens (np.ndarray): (num_sequences, longest) uint8/uint16 array,
+                zero padded, without the terminator.
+            lengths (np.ndarray): Length of each sequence.
+        """
+        rng = np.random.default_rng(seed)
+        dtype = np.uint8 if self.vocab_size <= 256 else np.uint16
+
+        tokens = np.zeros((num_sequences, min(max_length, 256)), dtype=dtype)
+        lengths = np.full(num_sequences, max_length, dtype=np.int64)
+        active = np.arange(num_sequences)
+        state = np.full(num_sequences, start, dtype=np.int64)
+
+        for t in range(max_length):
+            if len(active) == 0:
+                break
+            col = rng.integers(self.vocab_size, size=len(active))
+            u = rng.random(len(active))
+            state = np.where(u < self.prob[state, col], col, self.alias[state, col])
+
+            done = state == 0
+            lengths[active[done]] = t
+            active = active[~done]
+            state = state[~done]
+
+            if t >= tokens.shape[1]:
+                grown = np.zeros((num_sequences, min(2 * tokens.shape[1], max_length)),
+                                 dtype=dtype)
+                grown[:, :tokens.shape[1]] = tokens
+                tokens = grown
+            tokens[active, t] = state
+
+        return tokens[:, :lengths.max(initial=0)], lengths
+
+
+class JointChain:
+    """
+    First-order Markov chain over joint SATB states.
+
+    The state at each time step is the tuple of all voices' token indices,
+    packed into one integer code. Only states and transitions seen in the
+    corpus are kept, in CSR form: the successors of state s are
+    next_state[indptr[s]:indptr[s+1]]. Each row also gets an alias table
+    (prob, alias, indexed like next_state), so a step is O(1) whatever
+    the number of successors.
+    """
+
+    def __init__(self, store, voices=None):
+        voices = voices or store.voices
+        rows = [store.voices.index(v) for v in voices]
+        V = len(store.vocab)
+        self.voices = list(voices)
+        self.vocab_size = V
+
+        tokens = np.asarray(store.tokens[rows], dtype=np.int64)
+        codes = np.zeros(tokens.shape[1], dtype=np.int64)
+        for row in tokens:
+            codes *= V
+            codes += row
+
+        # Dense ids for the states that occur; codes are sorted, so the
+        # all-'.' delimiter state (code 0) is id 0
+        state_codes, state_ids = np.unique(codes, return_inverse=True)
+        S = len(state_codes)
+        self.state_tokens = np.stack(
+            [(state_codes // V ** (len(rows) - 1 - v)) % V for v in range(len(rows))],
+            axis=1).astype(store.tokens.dtype)
+        self.start_state = 0
+
+        # Transitions within chorales, grouped by source state
+        starts = _window_starts(store.offsets, 2)
+        pairs, counts = np.unique(state_ids[starts] * S + state_ids[starts + 1],
+                                  return_counts=True)
+        self.next_state = (pairs % S).astype(np.int32)
+        self.indptr = np.searchsorted(pairs // S, np.arange(S + 1))
+        self.counts = counts
+
+        # Most states have a single successor; only the others need tables
+        self.prob = np.ones(len(pairs))
+        self.alias = np.arange(len(pairs))
+        degree = np.diff(self.indptr)
+        for s in np.flatnonzero(degree > 1):
+            lo, hi = self.indptr[s], self.indptr[s + 1]
+            prob, alias = _alias_row(counts[lo:hi])
+            self.prob[lo:hi] = prob
+            self.alias[lo:hi] = alias + lo
+
+    @property
+    def num_states(self):
+        return len(self.state_tokens)
+
+    def sample(self, num_sequences=1, max_length=10000, seed=None):
+        """
+        Draw SATB sequences, starting from and ending at the '.' state.
+
+        Args:
+            num_sequences (int): Number of independent sequences.
+            max_length (int): Sequences still running after this many
+                steps are cut off.
+            seed (int): Seed for np.random.default_rng.
+
+        Returns:
+            tokens (np.ndarray): (num_sequences, longest, num_voices) token
+                indices, zero padded, without the terminator.
+            lengths (np.ndarray): Length of each sequence.
+        """
+        rng = np.random.default_rng(seed)
+        degree = np.diff(self.indptr)
+
+        states = np.zeros((num_sequences, min(max_length, 256)), dtype=np.int32)
+        lengths = np.full(num_sequences, max_length, dtype=np.int64)
+        active = np.arange(num_sequences)
+        state = np.full(num_sequences, self.start_state, dtype=np.int64)
+
+        for t in range(max_length):
+            if len(active) == 0:
+                break
+            deg = degree[state]
+            k = self.indptr[state] + (rng.random(len(active)) * deg).astype(np.int64)
+            # States never left in the corpus end the sequence
+            k = np.where(deg > 0, k, 0)
+            k = np.where(rng.random(len(active)) < self.prob[k], k, self.alias[k])
+            state = np.where(deg > 0, self.next_state[k], self.start_state)
+
+            done = state == self.start_state
+            lengths[active[done]] = t
+            active = active[~done]
+            state = state[~done]
+
+            if t >= states.shape[1]:
+                grown = np.zeros((num_sequences, min(2 * states.shape[1], max_length)),
+                                 dtype=np.int32)
+                grown[:, :states.shape[1]] = states
+                states = grown
+            states[active, t] = state
+
+        states = states[:, :lengths.max(initial=0)]
+        return self.state_tokens[states], lengths
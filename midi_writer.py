@@ -0,0 +1,142 @@
+"""
+Write token sequences straight to Standard MIDI File bytes, without
+building a music21 Score.
+"""
+import struct
+
+import numpy as np
+
+import util
+from vocab import STEP_SEMITONES, note_name_to_midi, vocab_tables
+
+
+def _vlq(values):
+    """
+    Variable-length quantities for an array of non-negative ints, as a
+    (n, 4) byte matrix and the number of bytes used per row (right-aligned).
+    """
+    values = np.asarray(values, dtype=np.int64)
+    shifts = np.array([21, 14, 7, 0])
+    groups = (values[:, None] >> shifts) & 0x7f
+    nbytes = 1 + (values >= 1 << 7) + (values >= 1 << 14) + (values >= 1 << 21)
+    # Continuation bit on every byte but the last
+    groups[:, :3] |= 0x80
+    return groups.astype(np.uint8), nbytes
+
+
+def _track_chunk(events):
+    return b'MTrk' + struct.pack('>I', len(events)) + events
+
+
+def _meta_track(tempo_bpm, time_signature, name=None):
+    numerator, denominator = time_signature
+    usec_per_quarter = int(round(60000000 / tempo_bpm))
+    events = b''
+    if name:
+        events += b'\x00\xff\x03' + bytes([len(name)]) + name.encode('latin-1')
+    events += b'\x00\xff\x51\x03' + usec_per_quarter.to_bytes(3, 'big')
+    events += b'\x00\xff\x58\x04' + bytes([numerator, denominator.bit_length() - 1, 24, 8])
+    events += b'\x00\xff\x2f\x00'
+    return _track_chunk(events)
+
+
+def _voice_track(pitches, lengths, ticks_per_step, channel, velocity, name):
+    """
+    One MIDI track from run pitches (-1 = silence) and run lengths.
+    All delta times and event bytes are built with array operations.
+    """
+    pitches = np.asarray(pitches, dtype=np.int64)
+    ends = np.cumsum(lengths) * ticks_per_step
+    starts = ends - np.asarray(lengths) * ticks_per_step
+
+    sounding = pitches >= 0
+    pitches = pitches[sounding]
+    starts = starts[sounding]
+    ends = ends[sounding]
+
+    # Interleave note-on/note-off events; rests just widen the next delta
+    times = np.empty(2 * len(pitches), dtype=np.int64)
+    times[0::2] = starts
+    times[1::2] = ends
+    deltas = np.diff(times, prepend=0)
+
+    status = np.empty(2 * len(pitches), dtype=np.uint8)
+    status[0::2] = 0x90 | channel
+    status[1::2] = 0x80 | channel
+    data = np.empty((2 * len(pitches), 2), dtype=np.uint8)
+    data[:, 0] = np.repeat(pitches, 2)
+    data[0::2, 1] = velocity
+    data[1::2, 1] = 0
+
+    vlq, nbytes = _vlq(deltas)
+    rows = np.concatenate([vlq, status[:, None], data], axis=1)
+    mask = np.ones(rows.shape, dtype=bool)
+    mask[:, :4] = np.arange(4) >= 4 - nbytes[:, None]
+
+    header = b'\x00\xff\x03' + bytes([len(name)]) + name.encode('latin-1')
+    return _track_chunk(header + rows[mask].tobytes() + b'\x00\xff\x2f\x00')
+
+
+def runs_to_midi(voices, time_step=0.25, tempo_bpm=90, time_signature=(4, 4),
+                 ticks_per_quarter=480, velocity=80):
+    """
+    Assemble a format 1 MIDI file from per-voice runs.
+
+    Args:
+        voices (dict): {voice name: (pitches, lengths)}, with the MIDI pitch
+            (-1 for silence) and length in time steps of each run.
+        time_step (float): quarterLength of one time step.
+        tempo_bpm (float): Tempo in quarter notes per minute.
+        time_signature (tuple): (numerator, denominator).
+        ticks_per_quarter (int): MIDI time resolution.
+        velocity (int): Note-on velocity.
+
+    Returns:
+        bytes: The complete Standard MIDI File.
+    """
+    ticks_per_step = int(round(time_step * ticks_per_quarter))
+
+    tracks = [_meta_track(tempo_bpm, time_signature)]
+    for v, (name, (pitches, lengths)) in enumerate(voices.items()):
+        # Skip channel 10, which is reserved for drums
+        channel = v if v < 9 else v + 1
+        tracks.append(_voice_track(pitches, lengths, ticks_per_step,
+                                   channel % 16, velocity, name))
+
+    header = b'MThd' + struct.pack('>IHHH', 6, 1, len(tracks), ticks_per_quarter)
+    return header + b''.join(tracks)
+
+
+def note_dict_to_midi(note_dict, time_step=0.25, **kwargs):
+    """
+    MIDI bytes for a note_dict of 'cont<Note>' tokens, as consumed by
+    util.reconstruct_score_cont. Extra keyword arguments go to runs_to_midi.
+    """
+    voices = {}
+    for part_name, tokens in note_dict.items():
+        symbols, lengths = util.token_runs(tokens)
+        pitches = [-1 if s == 'rest' else note_name_to_midi(s) for s in symbols]
+        voices[part_name] = (pitches, lengths)
+    return runs_to_midi(voices, time_step=time_step, **kwargs)
+
+
+def encoded_to_midi(encoded, vocab, time_step=0.25, **kwargs):
+    """
+    MIDI bytes for integer-encoded voices, e.g. a TokenStore chorale or
+    Markov samples. '.' delimiters are written as silence.
+
+    Args:
+        encoded (dict): {voice name: sequence of token indices}.
+        vocab (list or dict): Token name for each index (iton).
+        time_step (float): quarterLength of one time step.
+
+    Returns:
+        bytes: The complete Standard MIDI File.
+    """
+    midi, is_cont, base = vocab_tables(tuple(vocab[i] for i in range(len(vocab))))
+
+    voices = {}
+    for part_name, codes in encoded.items():
+        starts, lengths = util.code_runs(np.asarray(codes, dtype=np.int64), is_cont, base)
+        voices[part_name] = (midi[np.asarray(codes)[starts]], lengths)
+    return runs_to_midi(voices, time_step=time_step, **kwargs)
@@ -1,46 +1,247 @@
+import os
+import time
+
 import torch
 import numpy as np
 import torch.nn as nn
+import torch.distributed as dist
 import torch.nn.functional as F
+from torch.utils.data import (Dataset, IterableDataset, TensorDataset, DataLoader, Sampler,
+                              get_worker_info)
+
+import token_store
+
+# Target index that multipart_loss and multipart_accuracy skip (padding)
+IGNORE = -100
+
+
+def stack_parts(encoded, parts):
+    # {part: [idx, ...]} → one (T, num_parts) long tensor, the only copy made
+    return torch.as_tensor(np.stack([np.asarray(encoded[part]) for part in parts], axis=1),
+                           dtype=torch.long)
+
 
+def sliding_windows(seq, sequence_length):
+    # (T, P) → (T - sequence_length + 1, sequence_length, P) strided view, no copy;
+    # (0, sequence_length, P) when seq is shorter than one window
+    if len(seq) < sequence_length:
+        return seq.new_empty((0, sequence_length) + tuple(seq.shape[1:]))
+    return seq.unfold(0, sequence_length, 1).transpose(1, 2)
 
-from music21 import *
-import util
 
 def create_multivoice_training_data(encoded_notes, encoded_durations, sequence_length=8):
     parts = list(encoded_notes.keys())
-    num_parts = len(parts)
 
-    X_notes = []
-    X_durations = []
-    y_notes = []
-    y_durations = []
+    notes = stack_parts(encoded_notes, parts)       # (T, 4)
+    durs = stack_parts(encoded_durations, parts)    # (T, 4)
+
+    # Same windows as before: inputs i..i+seq_len-1, target at i+seq_len,
+    # for i in range(total_len - sequence_length - 1)
+    num_windows = max(len(notes) - sequence_length - 1, 0)
+
+    # All four results are views into notes/durs
+    X_notes = sliding_windows(notes, sequence_length)[:num_windows]        # (N, seq_len, 4)
+    X_durations = sliding_windows(durs, sequence_length)[:num_windows]
+    y_notes = notes[sequence_length:sequence_length + num_windows]          # (N, 4)
+    y_durations = durs[sequence_length:sequence_length + num_windows]
+
+    return X_notes, X_durations, y_notes, y_durations
+
+
+class MultiVoiceWindows(Dataset):
+    """
+    Training windows over many chorales, none crossing a chorale boundary.
+
+    All chorales are stacked once into (T_total, 4) tensors; windows are
+    strided views into them, so nothing is allocated per window. Items are
+    (notes, durations, note_target, duration_target) like the tensors of
+    create_multivoice_training_data; batch() gathers a minibatch at once.
+    """
+
+    def __init__(self, chorales, sequence_length=8, parts=None):
+        # chorales: list of (encoded_notes, encoded_durations) dict pairs;
+        # encoded_durations may be None when every step has the same duration
+        parts = parts or list(chorales[0][0].keys())
+        self.parts = parts
+        self.sequence_length = sequence_length
+
+        notes, durs, starts = [], [], []
+        offset = 0
+        for encoded_notes, encoded_durations in chorales:
+            cur_notes = np.stack([np.asarray(encoded_notes[part]) for part in parts], axis=1)
+            if encoded_durations is None:
+                cur_durs = np.zeros_like(cur_notes)
+            else:
+                cur_durs = np.stack([np.asarray(encoded_durations[part]) for part in parts], axis=1)
+            notes.append(cur_notes)
+            durs.append(cur_durs)
+            # Same per-chorale windows as create_multivoice_training_data
+            starts.append(offset + np.arange(max(len(cur_notes) - sequence_length - 1, 0)))
+            offset += len(cur_notes)
+
+        self.notes = torch.as_tensor(np.concatenate(notes), dtype=torch.long)
+        self.durs = torch.as_tensor(np.concatenate(durs), dtype=torch.long)
+        self.starts = torch.as_tensor(np.concatenate(starts), dtype=torch.long)
+
+        self.note_windows = sliding_windows(self.notes, sequence_length)
+        self.dur_windows = sliding_windows(self.durs, sequence_length)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, i):
+        s = self.starts[i]
+        L = self.sequence_length
+        return self.note_windows[s], self.dur_windows[s], self.notes[s + L], self.durs[s + L]
+
+    def batch(self, indices):
+        # One gather per tensor for a whole minibatch of window indices
+        s = self.starts[indices]
+        L = self.sequence_length
+        return self.note_windows[s], self.dur_windows[s], self.notes[s + L], self.durs[s + L]
+
+
+class StreamingWindows(IterableDataset):
+    """
+    Training windows streamed lazily from a TokenStore.
+
+    Chorales are split between DataLoader workers, each chorale is
+    windowed only when reached, and windows pass through a bounded shuffle
+    buffer, so memory stays constant however large the corpus is. Items
+    match MultiVoiceWindows; durations are all 0 since every token lasts
+    one time step.
 
-    total_len = len(next(iter(encoded_notes.values())))
+    transform(notes, rng), if given, maps each chorale's (T, 4) index
+    array before it is windowed, e.g. augment.RandomTransposition.
+    """
 
-    for i in range(total_len - sequence_length - 1):
-        note_seq = [encoded_notes[part][i:i+sequence_length] for part in parts]
-        dur_seq = [encoded_durations[part][i:i+sequence_length] for part in parts]
+    def __init__(self, store, sequence_length=8, shuffle_buffer=10000, seed=0, transform=None):
+        self.store = store
+        self.sequence_length = sequence_length
+        self.shuffle_buffer = shuffle_buffer
+        self.seed = seed
+        self.transform = transform
+        self.epoch = 0
 
-        # Shape: (4, seq_len) → transpose to (seq_len, 4)
-        note_seq = np.array(note_seq).T
-        dur_seq = np.array(dur_seq).T
+    def set_epoch(self, epoch):
+        # Reshuffle differently each epoch, identically across workers
+        self.epoch = epoch
 
-        # Targets: notes and durations at t+sequence_length
-        note_target = [encoded_notes[part][i+sequence_length] for part in parts]
-        dur_target = [encoded_durations[part][i+sequence_length] for part in parts]
+    def _chorale_windows(self, i, rng):
+        L = self.sequence_length
+        chorale = self.store[i]
+        notes = np.stack([chorale[v] for v in self.store.voices], axis=1)
+        if self.transform is not None:
+            notes = self.transform(notes, rng)
+        notes = torch.as_tensor(notes, dtype=torch.long)    # (T, 4)
+        durs = torch.zeros_like(notes)
+        note_windows = sliding_windows(notes, L)
+        dur_windows = sliding_windows(durs, L)
+        for s in range(max(len(notes) - L - 1, 0)):
+            yield note_windows[s], dur_windows[s], notes[s + L], durs[s + L]
 
-        X_notes.append(note_seq)
-        X_durations.append(dur_seq)
-        y_notes.append(note_target)
-        y_durations.append(dur_target)
+    def __iter__(self):
+        rng = np.random.default_rng((self.seed, self.epoch))
+        order = rng.permutation(len(self.store))
+
+        # Shard chorales across DataLoader worker processes
+        worker = get_worker_info()
+        if worker is not None:
+            order = order[worker.id::worker.num_workers]
+            rng = np.random.default_rng((self.seed, self.epoch, worker.id))
+
+        buffer = []
+        for i in order:
+            for item in self._chorale_windows(i, rng):
+                if len(buffer) < self.shuffle_buffer:
+                    buffer.append(item)
+                    continue
+                # Emit a random buffered window and keep the new one
+                j = rng.integers(len(buffer))
+                buffer[j], item = item, buffer[j]
+                yield item
+
+        rng.shuffle(buffer)
+        yield from buffer
+
+
+class SequenceChunks(Dataset):
+    """
+    Non-overlapping chunks of a TokenStore for teacher-forced sequence
+    training: each item is (notes, durations, note_targets,
+    duration_targets), all (chunk_length, 4), where the targets are the
+    inputs shifted one timestep ahead. Every timestep of a chorale is a
+    target exactly once; the last chunk of a chorale is padded with '.'
+    inputs and IGNORE targets, which multipart_loss skips.
+
+    Only the chunk start offsets are kept; each item is sliced from the
+    memory-mapped store when it is read. Pair it with EpochSampler for an
+    order that depends only on the seed and epoch, so fit can resume
+    mid-epoch exactly.
+    """
+
+    def __init__(self, store, chunk_length=64, seed=0):
+        self.store = store
+        self.chunk_length = chunk_length
+        self.seed = seed
+        self.epoch = 0
+
+        L = chunk_length
+        offsets = np.asarray(store.offsets)
+        lengths = np.diff(offsets)
+        counts = (lengths - 1 + L - 1) // L
+        chorale = np.repeat(np.arange(len(lengths)), counts)
+        first = np.repeat(np.cumsum(counts) - counts, counts)
+        self.starts = offsets[chorale] + L * (np.arange(counts.sum()) - first)
+        self.ends = offsets[chorale + 1]
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, i):
+        L = self.chunk_length
+        start, end = self.starts[i], min(self.starts[i] + L + 1, self.ends[i])
+        tokens = torch.as_tensor(self.store.tokens[:, start:end].T.astype(np.int64))
+
+        notes = torch.zeros(L, tokens.shape[1], dtype=torch.long)
+        notes[:len(tokens)] = tokens[:L]
+        targets = torch.full_like(notes, IGNORE)
+        targets[:len(tokens) - 1] = tokens[1:]
+        # Every token lasts one time step, so all durations are index 0
+        durs = torch.zeros_like(notes)
+        dur_targets = torch.where(targets == IGNORE, targets, 0)
+        return notes, durs, targets, dur_targets
+
+
+class EpochSampler(Sampler):
+    """
+    Sampler for a dataset with seed and set_epoch (e.g. SequenceChunks):
+    one permutation per (seed, epoch), drawn when iteration starts.
+
+    With num_shards > 1, shard r gets positions r, r + num_shards, ... of
+    the permutation, after dropping the len % num_shards last items so all
+    shards are the same length. With a batch size of b per shard, the k-th
+    batches of all shards together are then the k-th batch of size
+    num_shards * b of that order.
+    """
+
+    def __init__(self, dataset, num_shards=1, shard=0):
+        self.dataset = dataset
+        self.num_shards = num_shards
+        self.shard = shard
+
+    def __len__(self):
+        return len(self.dataset) // self.num_shards
+
+    def __iter__(self):
+        order = np.random.default_rng((self.dataset.seed, self.dataset.epoch)).permutation(
+            len(self.dataset))
+        order = order[:len(self) * self.num_shards]
+        return iter(order[self.shard::self.num_shards].tolist())
 
-    return (
-        torch.tensor(X_notes, dtype=torch.long),
-        torch.tensor(X_durations, dtype=torch.long),
-        torch.tensor(y_notes, dtype=torch.long),
-        torch.tensor(y_durations, dtype=torch.long)
-    )
 
 class MultiPartGenerator(nn.Module):
     def __init__(self, note_vocab_size, dur_vocab_size, embed_dim=32, lstm_hidden=128, num_parts=4):
@@ -57,41 +258,285 @@ class MultiPartGenerator(nn.Module):
         self.note_vocab_size = note_vocab_size
         self.dur_vocab_size = dur_vocab_size
 
-    def forward(self, notes_in, durs_in):
+    def embed(self, notes_in, durs_in):
         # Shape: (B, T, 4)
         emb_notes = self.note_embed(notes_in)   # → (B, T, 4, D)
         emb_durs = self.dur_embed(durs_in)      # → (B, T, 4, D)
 
         combined = torch.cat([emb_notes, emb_durs], dim=-1)  # → (B, T, 4, 2D)
-        combined = combined.view(combined.shape[0], combined.shape[1], -1)  # → (B, T, 4*2D)
+        return combined.view(combined.shape[0], combined.shape[1], -1)  # → (B, T, 4*2D)
+
+    def heads(self, hidden):
+        # (B, H) → (B, 4, Vn), (B, 4, Vd)
+        note_logits = self.note_out(hidden).view(-1, self.num_parts, self.note_vocab_size)
+        dur_logits = self.dur_out(hidden).view(-1, self.num_parts, self.dur_vocab_size)
+        return note_logits, dur_logits
+
+    def forward(self, notes_in, durs_in, all_steps=False):
+        lstm_out, _ = self.lstm(self.embed(notes_in, durs_in))      # → (B, T, H)
+        if all_steps:
+            # Next-step predictions at every position → (B, T, 4, V)
+            B, T, H = lstm_out.shape
+            note_logits, dur_logits = self.heads(lstm_out.reshape(B * T, H))
+            return (note_logits.view(B, T, self.num_parts, -1),
+                    dur_logits.view(B, T, self.num_parts, -1))
 
-        lstm_out, _ = self.lstm(combined)      # → (B, T, H)
         final = lstm_out[:, -1, :]             # → (B, H)
 
-        note_logits = self.note_out(final).view(-1, self.num_parts, self.note_vocab_size)  # (B, 4, Vn)
-        dur_logits = self.dur_out(final).view(-1, self.num_parts, self.dur_vocab_size)     # (B, 4, Vd)
+        return self.heads(final)
 
-        return note_logits, dur_logits
+    def step(self, notes_in, durs_in, state=None):
+        # Like forward, but continues from an LSTM (h, c) state and returns the new one
+        lstm_out, state = self.lstm(self.embed(notes_in, durs_in), state)
+        note_logits, dur_logits = self.heads(lstm_out[:, -1, :])
+        return note_logits, dur_logits, state
+
+    # torch re-enters no_grad on every resume of a generator, so grad mode is
+    # only off while a step or select runs, never in the caller's code
+    @torch.no_grad()
+    def generate(self, notes_seed, durs_seed, steps, select=None):
+        """
+        Autoregressive generation that carries the LSTM state forward.
+
+        The seeds, (T, 4) or (B, T, 4) index tensors, are run once; after
+        that each step feeds only the newest timestep, so a step costs the
+        same however long the piece already is. Tokens are yielded as soon
+        as they are produced.
+
+        Args:
+            notes_seed, durs_seed (torch.Tensor): Seed sequences.
+            steps (int): Number of timesteps to generate.
+            select (callable): Maps (note_logits, dur_logits), each (B, 4, V),
+                to (notes, durs) index tensors of shape (B, 4). Defaults to
+                argmax, as in predict_next_all_parts.
+
+        Yields:
+            (notes, durs): (B, 4) index tensors for one timestep.
+        """
+        if notes_seed.dim() == 2:
+            notes_seed, durs_seed = notes_seed.unsqueeze(0), durs_seed.unsqueeze(0)
+
+        note_logits, dur_logits, state = self._eval_step(notes_seed, durs_seed)
+        for _ in range(steps):
+            if select is None:
+                notes, durs = note_logits.argmax(dim=-1), dur_logits.argmax(dim=-1)
+            else:
+                notes, durs = select(note_logits, dur_logits)
+            yield notes, durs
+            note_logits, dur_logits, state = self._eval_step(
+                notes.unsqueeze(1), durs.unsqueeze(1), state)
+
+    def _eval_step(self, notes_in, durs_in, state=None):
+        # Eval mode only for this step, so the caller's mode is back in place
+        # whenever generate() yields
+        was_training = self.training
+        self.eval()
+        try:
+            return self.step(notes_in, durs_in, state)
+        finally:
+            self.train(was_training)
     
     
-def train_model(model, Xn, Xd, yn, yd, epochs=10, lr=0.001):
+def multipart_loss(out_notes, out_durs, yn, yd):
+    # One cross-entropy over all (window, part) pairs per head, or all
+    # (sequence, position, part) triples for all_steps outputs; IGNORE
+    # targets are skipped. Scaled by the number of parts to match the old
+    # sum of per-part mean losses.
+    num_parts = out_notes.shape[-2]
+    loss_note = F.cross_entropy(out_notes.reshape(-1, out_notes.shape[-1]), yn.reshape(-1),
+                                ignore_index=IGNORE)
+    loss_dur = F.cross_entropy(out_durs.reshape(-1, out_durs.shape[-1]), yd.reshape(-1),
+                               ignore_index=IGNORE)
+    return (loss_note + loss_dur) * num_parts
+
+
+def multipart_accuracy(out_notes, out_durs, yn, yd):
+    # Correct and counted (note, duration) predictions, over all parts
+    mask = yn != IGNORE
+    correct_notes = ((out_notes.argmax(-1) == yn) & mask).sum().item()
+    correct_durs = ((out_durs.argmax(-1) == yd) & mask).sum().item()
+    return correct_notes, correct_durs, mask.sum().item()
+
+
+def _predict(model, Xn, Xd, yn):
+    # Targets with a time axis, as from SequenceChunks, train every position
+    if yn.dim() == 3:
+        return model(Xn, Xd, all_steps=True)
+    return model(Xn, Xd)
+
+
+def evaluate(model, loader):
+    """
+    Loss and accuracy over a loader of windows or sequence chunks.
+
+    Returns:
+        dict: 'loss' (mean per batch), 'note_accuracy' and
+        'duration_accuracy' (over every part of every target timestep).
+    """
+    was_training = model.training
+    model.eval()
+    losses, notes, durs, total = [], 0, 0, 0
+    with torch.no_grad():
+        for Xn, Xd, yn, yd in loader:
+            out_notes, out_durs = _predict(model, Xn, Xd, yn)
+            losses.append(multipart_loss(out_notes, out_durs, yn, yd).item())
+            n, d, t = multipart_accuracy(out_notes, out_durs, yn, yd)
+            notes, durs, total = notes + n, durs + d, total + t
+    model.train(was_training)
+    return {'loss': float(np.mean(losses)) if losses else float('nan'),
+            'note_accuracy': notes / max(total, 1),
+            'duration_accuracy': durs / max(total, 1)}
+
+
+def save_checkpoint(path, model, optimizer, epoch, step, batch):
+    # Written to a temporary file first, so a crash never leaves a broken checkpoint
+    torch.save({'model': model.state_dict(),
+                'optimizer': optimizer.state_dict(),
+                'epoch': epoch, 'step': step, 'batch': batch}, path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+
+def _process_group():
+    # (rank, world_size) when fit runs under torch.distributed, e.g. with a
+    # DistributedDataParallel model from train_parallel.py
+    if dist.is_available() and dist.is_initialized():
+        return dist.get_rank(), dist.get_world_size()
+    return 0, 1
+
+
+def _all_sum(values, world_size):
+    if world_size == 1:
+        return values
+    total = torch.tensor(values, dtype=torch.float64)
+    dist.all_reduce(total)
+    return total.tolist()
+
+
+def fit(model, loader, epochs=10, lr=0.001, accumulation_steps=1,
+        checkpoint_path=None, checkpoint_every=1000, log_every=100,
+        loss_weight=None, max_steps=None):
+    """
+    Minibatch training loop.
+
+    Each batch from loader is (Xn, Xd, yn, yd). With (B, 4) targets, as
+    from windows, each sequence is trained on its next timestep; with
+    (B, T, 4) targets, as from SequenceChunks, on the next timestep at
+    every position (teacher forcing). Gradients are accumulated over
+    accumulation_steps batches per optimizer step. Memory depends only on
+    the batch size, not on the corpus size.
+
+    If checkpoint_path exists, training resumes from it. The position
+    within an epoch is restored exactly for datasets with set_epoch (such
+    as StreamingWindows, or SequenceChunks with an EpochSampler), which
+    give the same order for the same epoch.
+
+    Under torch.distributed (model wrapped in DistributedDataParallel),
+    losses, accuracies and throughput are summed over all processes, and
+    only rank 0 prints and writes checkpoints, of the unwrapped model.
+    loss_weight(yn), if given, scales each batch's loss, e.g. to weight
+    the processes' losses by their share of the targets. Training stops
+    after max_steps optimizer steps, if given.
+
+    Returns:
+        list: Loss of every optimizer step.
+    """
     optimizer = torch.optim.Adam(model.parameters(), lr=lr)
-    loss_fn = nn.CrossEntropyLoss()
+    start_epoch, step, skip = 0, 0, 0
+    net = getattr(model, 'module', model)
+    rank, world_size = _process_group()
+    main = rank == 0
+
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        checkpoint = torch.load(checkpoint_path)
+        net.load_state_dict(checkpoint['model'])
+        optimizer.load_state_dict(checkpoint['optimizer'])
+        start_epoch, step, skip = checkpoint['epoch'], checkpoint['step'], checkpoint['batch']
+        if main:
+            print(f"Resuming from {checkpoint_path}: epoch {start_epoch+1}, step {step}")
 
+    history = []
     model.train()
-    for epoch in range(epochs):
+    for epoch in range(start_epoch, epochs):
+        if hasattr(loader.dataset, 'set_epoch'):
+            loader.dataset.set_epoch(epoch)
+
         optimizer.zero_grad()
-        out_notes, out_durs = model(Xn, Xd)
+        step_loss, pending = 0., 0
+        windows, t0 = 0, time.perf_counter()
+        correct_notes, correct_durs, targets = 0, 0, 0
 
-        # Reshape targets to match predictions: (B, 4)
-        loss_note = sum([loss_fn(out_notes[:, i], yn[:, i]) for i in range(4)])
-        loss_dur = sum([loss_fn(out_durs[:, i], yd[:, i]) for i in range(4)])
-        loss = loss_note + loss_dur
+        for i, (Xn, Xd, yn, yd) in enumerate(loader):
+            if epoch == start_epoch and i < skip:
+                continue
 
-        loss.backward()
-        optimizer.step()
-        
-        print(f"Epoch {epoch+1}/{epochs}, Loss: {loss.item():.4f}")
+            out_notes, out_durs = _predict(model, Xn, Xd, yn)
+            loss = multipart_loss(out_notes, out_durs, yn, yd) / accumulation_steps
+            if loss_weight is not None:
+                loss = loss * loss_weight(yn)
+            loss.backward()
+            step_loss += loss.item()
+            pending += 1
+
+            n, d, t = multipart_accuracy(out_notes.detach(), out_durs.detach(), yn, yd)
+            correct_notes, correct_durs, targets = correct_notes + n, correct_durs + d, targets + t
+            # A supervised timestep counts as one window, whichever the mode
+            windows += t // yn.shape[-1]
+
+            if pending < accumulation_steps:
+                continue
+
+            optimizer.step()
+            optimizer.zero_grad()
+            step += 1
+            history.append(_all_sum([step_loss], world_size)[0] / world_size)
+            step_loss, pending = 0., 0
+
+            if step % log_every == 0:
+                rate = _all_sum([windows], world_size)[0] / (time.perf_counter() - t0)
+                if main:
+                    print(f"Epoch {epoch+1}/{epochs}, Step {step}, Loss: {history[-1]:.4f}, "
+                          f"{rate:.0f} windows/sec")
+            if checkpoint_path and main and step % checkpoint_every == 0:
+                save_checkpoint(checkpoint_path, net, optimizer, epoch, step, i + 1)
+            if max_steps and step >= max_steps:
+                if checkpoint_path and main:
+                    save_checkpoint(checkpoint_path, net, optimizer, epoch, step, i + 1)
+                return history
+
+        # Apply what is left of the last accumulation window
+        if pending:
+            for p in model.parameters():
+                if p.grad is not None:
+                    p.grad *= accumulation_steps / pending
+            optimizer.step()
+            optimizer.zero_grad()
+            step += 1
+            history.append(_all_sum([step_loss * accumulation_steps / pending],
+                                    world_size)[0] / world_size)
+
+        correct_notes, correct_durs, targets = _all_sum([correct_notes, correct_durs, targets],
+                                                        world_size)
+        accuracy = (f", note acc: {correct_notes / targets:.3f}, "
+                    f"dur acc: {correct_durs / targets:.3f}" if targets else "")
+        if main:
+            print(f"Epoch {epoch+1}/{epochs}, Loss: {history[-1]:.4f}{accuracy}" if history else
+                  f"Epoch {epoch+1}/{epochs}")
+        if checkpoint_path and main:
+            save_checkpoint(checkpoint_path, net, optimizer, epoch + 1, step, 0)
+
+    return history
+
+
+def train_model(model, Xn, Xd, yn, yd, epochs=10, lr=0.001, batch_size=None, **kwargs):
+    # Tensors from create_multivoice_training_data; batch_size=None keeps
+    # the old full-batch behaviour. Extra arguments go to fit().
+    dataset = TensorDataset(Xn, Xd, yn, yd)
+    if len(dataset) == 0:
+        # e.g. a piece shorter than one window; nothing to train on
+        return []
+    loader = DataLoader(dataset, batch_size=batch_size or len(dataset),
+                        shuffle=batch_size is not None)
+    return fit(model, loader, epochs=epochs, lr=lr, **kwargs)
         
         
 def predict_next_all_parts(model, note_seq, dur_seq):
@@ -108,23 +553,23 @@ def predict_next_all_parts(model, note_seq, dur_seq):
         
 if __name__=='__main__':
     
-    paths = corpus.getComposer('bach')
-
-    for path in paths:
-       
-        sBach = corpus.parse(str(path))
-        if len(sBach.parts) == 4:
-            break
-        
-    note_dict, duration_dict = util.extract_notes_and_durations_cont(sBach)
-    pitch2idx, duration2idx, encoded_notes, encoded_durations = util.encode_sequences(note_dict, duration_dict)
-
-    # # Prepare tensors
-    # Xn, Xd, yn, yd = create_multivoice_training_data(encoded_notes, encoded_durations, sequence_length=8)
+    # Packed corpus written by create_dataset.py
+    store = token_store.TokenStore('bach_tokens')
+    
+    # Teacher-forced training on non-overlapping chunks (every timestep is a
+    # target once); chunk_length=None streams one-target windows instead,
+    # with memory bounded by the shuffle buffer
+    chunk_length = 64
+    if chunk_length:
+        dataset = SequenceChunks(store, chunk_length=chunk_length)
+        loader = DataLoader(dataset, batch_size=16, sampler=EpochSampler(dataset))
+    else:
+        dataset = StreamingWindows(store, sequence_length=8, shuffle_buffer=10000)
+        loader = DataLoader(dataset, batch_size=256, num_workers=2)
     
-    # # Model
-    # note_vocab_size = len(pitch2idx)
-    # dur_vocab_size = len(duration2idx)
+    # Model
+    note_vocab_size = len(store.vocab)
+    dur_vocab_size = 1
     
-    # model = MultiPartGenerator(note_vocab_size, dur_vocab_size)
-    # train_model(model, Xn, Xd, yn, yd, epochs=20)
\ No newline at end of file
+    model = MultiPartGenerator(note_vocab_size, dur_vocab_size)
+    fit(model, loader, epochs=20, checkpoint_path='multipart_generator.pt')
@@ -0,0 +1,181 @@
+"""
+Timing spans and counters for the dataset pipeline.
+
+Profiling is off by default; span() then returns a shared no-op context
+manager and count() returns at once, so instrumented code pays about one
+attribute check per call. Turn it on with enable(), then export with
+write_summary() (per-stage totals and counters as JSON) or
+write_chrome_trace() (open in chrome://tracing or Perfetto).
+
+    with profiling.span('parse', path=path):
+        score = corpus.parse(path)
+    profiling.count('files_parsed')
+"""
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('profiler', 'name', 'args', 'start')
+
+    def __init__(self, profiler, name, args):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        self.profiler.events.append((self.name, self.start, end - self.start,
+                                     os.getpid(), threading.get_ident(), self.args))
+        return False
+
+
+class Profiler:
+    """
+    Collects spans as (name, start_ns, duration_ns, pid, tid, args) tuples
+    and counters as {name: total}. Timestamps come from perf_counter_ns,
+    which shares one clock across processes on the same machine, so spans
+    recorded in worker processes can be merged into one trace.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.events = []
+        self.counters = {}
+
+    def span(self, name, **args):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def export(self):
+        # Plain data, so it can be returned from a worker process
+        return {'events': list(self.events), 'counters': dict(self.counters)}
+
+    def merge(self, data):
+        if not data:
+            return
+        self.events.extend(tuple(e) for e in data['events'])
+        for name, n in data['counters'].items():
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def reset(self):
+        self.events = []
+        self.counters = {}
+
+    def summary(self, slowest=10):
+        """
+        Per-span totals and counters.
+
+        Returns:
+            dict: 'spans' ({name: count, total_s, mean_s, max_s}),
+                'counters', and 'slowest' (the longest 'file' spans, i.e.
+                the files that took longest end to end).
+        """
+        spans = {}
+        for name, _, dur, _, _, _ in self.events:
+            s = spans.setdefault(name, {'count': 0, 'total_s': 0., 'max_s': 0.})
+            s['count'] += 1
+            s['total_s'] += dur / 1e9
+            s['max_s'] = max(s['max_s'], dur / 1e9)
+        for s in spans.values():
+            s['mean_s'] = s['total_s'] / s['count']
+
+        per_file = sorted((e for e in self.events if e[0] == 'file'),
+                          key=lambda e: e[2], reverse=True)[:slowest]
+        return {'spans': spans,
+                'counters': dict(self.counters),
+                'slowest': [{'name': name, 'path': args['path'], 'seconds': dur / 1e9}
+                            for name, _, dur, _, _, args in per_file]}
+
+    def write_summary(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def write_chrome_trace(self, path):
+        """
+        Write spans as Chrome trace 'complete' events; counter totals go
+        in the trace metadata.
+        """
+        t0 = min((e[1] for e in self.events), default=0)
+        trace = [{'name': name, 'cat': 'pipeline', 'ph': 'X',
+                  'ts': (start - t0) / 1e3, 'dur': dur / 1e3,
+                  'pid': pid, 'tid': tid,
+                  'args': {k: str(v) for k, v in args.items()}}
+                 for name, start, dur, pid, tid, args in self.events]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms',
+                       'otherData': {'counters': self.counters}}, f)
+
+
+# Process-wide profiler used by the module-level helpers
+profiler = Profiler()
+
+
+def enable():
+    profiler.enabled = True
+
+
+def disable():
+    profiler.enabled = False
+
+
+def enabled():
+    return profiler.enabled
+
+
+def span(name, **args):
+    if not profiler.enabled:
+        return _NULL_SPAN
+    return _Span(profiler, name, args)
+
+
+def count(name, n=1):
+    if profiler.enabled:
+        profiler.counters[name] = profiler.counters.get(name, 0) + n
+
+
+@contextmanager
+def capture(enabled=True):
+    """
+    Record into a fresh profiler for the duration of the block, e.g. in a
+    pool worker, and yield it so its export() can be sent back and merged.
+    """
+    global profiler
+    saved, profiler = profiler, Profiler(enabled)
+    try:
+        yield profiler
+    finally:
+        profiler = saved
+
+
+def write_summary(path):
+    profiler.write_summary(path)
+
+
+def write_chrome_trace(path):
+    profiler.write_chrome_trace(path)
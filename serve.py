@@ -0,0 +1,308 @@
+"""
+Local asyncio HTTP service for chorale generation with dynamic
+micro-batching.
+
+Requests that arrive while a batch is being generated wait in a queue;
+the next batch takes up to max_batch_size of them, waiting at most
+max_wait_ms for the batch to fill. Many single-sequence requests thus
+become a few batched forward passes (or batched Markov draws).
+
+Endpoints:
+    POST /generate  JSON body {"steps": 64, "format": "midi" | "tokens",
+                    "temperature": 1.0, "seed": [[s, a, t, b], ...]}; all
+                    fields optional, steps and the seed length at most
+                    max_steps. Returns audio/midi bytes or
+                    {"voices": {voice: [token index, ...]}}.
+    GET  /stats     Queue depth, batch-size distribution and latency
+                    percentiles.
+"""
+import asyncio
+import json
+import time
+from collections import Counter, deque
+
+import numpy as np
+
+import markov
+import midi_writer
+
+
+class ModelBackend:
+    """
+    Batched generation with a MultiPartGenerator, or with the TorchScript
+    artifact from export.py (anything with a compatible step method).
+
+    Seeds of different lengths are left-padded with the '.' delimiter
+    (index 0), which is how every chorale in the corpus starts. Without
+    a seed, generation starts from a single delimiter timestep.
+    """
+
+    def __init__(self, model, vocab, voices, hidden_size=128):
+        self.model = model.eval()
+        self.vocab = vocab
+        self.voices = voices
+        self.hidden_size = hidden_size
+
+    def run(self, requests):
+        # torch is only loaded for this backend; the bigram one starts fast
+        import torch
+        from decoding import sample_logits
+
+        B, P = len(requests), len(self.voices)
+        steps = max(r.get('steps', 64) for r in requests)
+        seeds = [r.get('seed') or [[0] * P] for r in requests]
+        T = max(len(s) for s in seeds)
+
+        notes = torch.zeros(B, T, P, dtype=torch.long)
+        for b, seed in enumerate(seeds):
+            notes[b, T - len(seed):] = torch.tensor(seed, dtype=torch.long)
+        durs = torch.zeros_like(notes)
+        temperature = torch.tensor([float(r.get('temperature', 1.)) for r in requests])
+        greedy = (temperature == 0).view(B, 1)
+        scale = torch.where(temperature > 0, temperature, torch.ones(B)).view(B, 1, 1)
+
+        state = (torch.zeros(1, B, self.hidden_size), torch.zeros(1, B, self.hidden_size))
+        out = torch.zeros(B, steps, P, dtype=torch.long)
+        with torch.no_grad():
+            note_logits, dur_logits, state = self.model.step(notes, durs, state)
+            for t in range(steps):
+                sampled = sample_logits(note_logits / scale)
+                out[:, t] = torch.where(greedy, note_logits.argmax(-1), sampled)
+                note_logits, dur_logits, state = self.model.step(
+                    out[:, t:t+1], dur_logits.argmax(-1).unsqueeze(1), state)
+
+        results = []
+        for b, r in enumerate(requests):
+            tokens = out[b, :r.get('steps', 64)].numpy()
+            # A '.' in every voice ends the chorale
+            end = np.flatnonzero((tokens == 0).all(axis=1))
+            tokens = tokens[:end[0]] if len(end) else tokens
+            results.append({v: tokens[:, i].tolist() for i, v in enumerate(self.voices)})
+        return results
+
+
+class BigramBackend:
+    """
+    Independent per-voice bigram chains, as sampled in create_dataset.py,
+    from a counts file written by markov.save_counts. Seeds and
+    temperature are ignored.
+    """
+
+    def __init__(self, counts, voices, vocab):
+        self.vocab = vocab
+        self.voices = voices
+        self.samplers = [markov.AliasSampler(c) for c in counts]
+        self.rng = np.random.default_rng()
+
+    def run(self, requests):
+        max_length = max(r.get('steps', 64) for r in requests)
+        per_voice = [s.sample(len(requests), max_length=max_length,
+                              seed=self.rng.integers(2 ** 63))
+                     for s in self.samplers]
+        results = []
+        for b, r in enumerate(requests):
+            steps = r.get('steps', 64)
+            results.append({v: tokens[b, :min(lengths[b], steps)].tolist()
+                            for v, (tokens, lengths) in zip(self.voices, per_voice)})
+        return results
+
+
+class MicroBatcher:
+    """
+    Queue in front of a backend's run(requests) -> results. Batches run
+    one at a time in a worker thread, so the event loop keeps accepting
+    requests (which then form the next batch) while a batch is running.
+    """
+
+    def __init__(self, run, max_batch_size=32, max_wait_ms=5., history=10000):
+        self.run = run
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue()
+        self.batch_sizes = Counter()
+        self.latencies = deque(maxlen=history)
+        self.requests = 0
+
+    async def submit(self, request):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((request, future, time.perf_counter()))
+        return await future
+
+    async def _next_batch(self):
+        batch = [await self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # Whatever is already queued joins the batch without waiting
+        while len(batch) < self.max_batch_size and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    async def worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            requests = [request for request, _, _ in batch]
+            try:
+                results = await loop.run_in_executor(None, self.run, requests)
+            except Exception as e:
+                results = [e] * len(batch)
+
+            done = time.perf_counter()
+            self.batch_sizes[len(batch)] += 1
+            for (_, future, t0), result in zip(batch, results):
+                self.latencies.append(done - t0)
+                self.requests += 1
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def stats(self):
+        latencies = np.array(self.latencies) * 1e3
+        return {
+            'queue_depth': self.queue.qsize(),
+            'requests': self.requests,
+            'batches': sum(self.batch_sizes.values()),
+            'batch_sizes': {str(k): v for k, v in sorted(self.batch_sizes.items())},
+            'mean_batch_size': (self.requests / max(sum(self.batch_sizes.values()), 1)),
+            'latency_ms': {
+                'p50': float(np.percentile(latencies, 50)) if len(latencies) else None,
+                'p99': float(np.percentile(latencies, 99)) if len(latencies) else None,
+            },
+        }
+
+
+async def _read_request(reader):
+    request_line = (await reader.readline()).decode('latin-1').split()
+    if len(request_line) < 2:
+        return None, None, b''
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode('latin-1').strip()
+        if not line:
+            break
+        key, _, value = line.partition(':')
+        headers[key.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get('content-length', 0)))
+    return request_line[0], request_line[1], body
+
+
+def _check_request(request, num_voices, vocab_size, max_steps):
+    # Checked before queueing, so one bad request cannot fail or stall a
+    # whole batch
+    if not isinstance(request, dict):
+        raise ValueError("request body must be a JSON object")
+    steps = request.get('steps', 64)
+    if not isinstance(steps, int) or not 1 <= steps <= max_steps:
+        raise ValueError(f"steps must be an integer from 1 to {max_steps}")
+    if request.get('format', 'midi') not in ('midi', 'tokens'):
+        raise ValueError("format must be 'midi' or 'tokens'")
+    if float(request.get('temperature', 1.)) < 0:
+        raise ValueError("temperature must not be negative")
+    seed = request.get('seed') or []
+    if len(seed) > max_steps:
+        raise ValueError(f"seed must not be longer than {max_steps} timesteps")
+    for row in seed:
+        if len(row) != num_voices or not all(0 <= int(t) < vocab_size for t in row):
+            raise ValueError(f"seed rows must hold {num_voices} token indices")
+
+
+def _response(status, body, content_type='application/json'):
+    if not isinstance(body, bytes):
+        body = json.dumps(body).encode()
+    head = (f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n")
+    return head.encode('latin-1') + body
+
+
+class GenerationServer:
+
+    def __init__(self, backend, max_batch_size=32, max_wait_ms=5., time_step=0.25,
+                 max_steps=1024):
+        self.backend = backend
+        self.max_steps = max_steps
+        self.batcher = MicroBatcher(backend.run, max_batch_size, max_wait_ms)
+        self.time_step = time_step
+
+    async def handle(self, reader, writer):
+        try:
+            method, path, body = await _read_request(reader)
+            if method == 'GET' and path == '/stats':
+                writer.write(_response('200 OK', self.batcher.stats()))
+            elif method == 'POST' and path == '/generate':
+                request = json.loads(body or b'{}')
+                _check_request(request, len(self.backend.voices), len(self.backend.vocab),
+                               self.max_steps)
+                voices = await self.batcher.submit(request)
+                if request.get('format', 'midi') == 'midi':
+                    midi = midi_writer.encoded_to_midi(voices, self.backend.vocab,
+                                                       time_step=self.time_step)
+                    writer.write(_response('200 OK', midi, 'audio/midi'))
+                else:
+                    writer.write(_response('200 OK', {'voices': voices}))
+            else:
+                writer.write(_response('404 Not Found', {'error': 'not found'}))
+        except (ValueError, KeyError, TypeError) as e:
+            writer.write(_response('400 Bad Request', {'error': str(e)}))
+        except Exception as e:
+            writer.write(_response('500 Internal Server Error', {'error': str(e)}))
+        finally:
+            await writer.drain()
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8000):
+        worker = asyncio.create_task(self.batcher.worker())
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"Serving on http://{host}:{port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            worker.cancel()
+
+
+if __name__ == '__main__':
+    import argparse
+    import token_store
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--backend', choices=['model', 'bigram'], default='model')
+    parser.add_argument('--store', default='bach_tokens')
+    parser.add_argument('--checkpoint', default='multipart_generator.pt',
+                        help="fit() checkpoint, or a TorchScript file from export.py")
+    parser.add_argument('--bigrams', default=None, help="default: <store>/bigrams.npz")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max-batch-size', type=int, default=32)
+    parser.add_argument('--max-wait-ms', type=float, default=5.)
+    parser.add_argument('--max-steps', type=int, default=1024,
+                        help="longest generation (and seed) a request may ask for")
+    args = parser.parse_args()
+
+    if args.backend == 'bigram':
+        counts, voices, vocab = markov.load_counts(args.bigrams or f"{args.store}/bigrams.npz")
+        backend = BigramBackend(counts, voices, vocab)
+    else:
+        import torch
+
+        store = token_store.TokenStore(args.store)
+        try:
+            net = torch.jit.load(args.checkpoint, map_location='cpu')
+        except RuntimeError:
+            import model as mdl
+            net = mdl.MultiPartGenerator(len(store.vocab), 1)
+            net.load_state_dict(torch.load(args.checkpoint)['model'])
+        backend = ModelBackend(net, store.vocab, store.voices, net.lstm.hidden_size)
+
+    server = GenerationServer(backend, args.max_batch_size, args.max_wait_ms,
+                              max_steps=args.max_steps)
+    asyncio.run(server.serve(args.host, args.port))
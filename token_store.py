@@ -0,0 +1,99 @@
+import os
+import json
+
+import numpy as np
+
+VOICES = ['Soprano', 'Alto', 'Tenor', 'Bass']
+
+
+class TokenStore:
+    """
+    Read-only view of a packed token corpus written by pack_corpus.
+
+    All voices share one (num_voices, num_tokens) small-int array, opened
+    with np.memmap, so loading is near instant and the pages are shared by
+    every process that opens the same store. Chorale i spans columns
+    offsets[i]:offsets[i+1] in every voice.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.voices = self.meta['voices']
+        self.vocab = self.meta['vocab']
+        self.keys = self.meta['keys']
+        self.tokens = np.load(os.path.join(path, 'tokens.npy'), mmap_mode='r')
+        self.offsets = np.load(os.path.join(path, 'offsets.npy'), mmap_mode='r')
+
+    def __getstate__(self):
+        # Pickle by path, so worker processes map the same files instead of
+        # receiving a copy of the arrays
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        """
+        Token arrays of chorale i, as {voice: view}. No data is copied.
+        """
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return {voice: self.tokens[v, start:end]
+                for v, voice in enumerate(self.voices)}
+
+    def voice(self, name):
+        """
+        The whole packed array of one voice, all chorales back to back.
+        """
+        return self.tokens[self.voices.index(name)]
+
+    def chorale_lengths(self):
+        return np.diff(self.offsets)
+
+
+def pack_corpus(chorales, path, vocab, keys=None, voices=VOICES):
+    """
+    Pack encoded chorales into a TokenStore directory.
+
+    Args:
+        chorales (list): One {voice: list of token indices} dict per chorale,
+            all voices of a chorale having the same length.
+        path (str): Output directory, created if needed.
+        vocab (list): Token name for each index (e.g. iton as a list).
+        keys (list): Optional identifier per chorale (e.g. corpus path).
+        voices (list): Voice names, in storage order.
+
+    Returns:
+        TokenStore: The freshly written store.
+    """
+    os.makedirs(path, exist_ok=True)
+
+    lengths = [len(c[voices[0]]) for c in chorales]
+    offsets = np.zeros(len(chorales) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    dtype = np.uint8 if len(vocab) <= 256 else np.uint16
+    tokens = np.lib.format.open_memmap(os.path.join(path, 'tokens.npy'), mode='w+',
+                                       dtype=dtype, shape=(len(voices), int(offsets[-1])))
+    for i, chorale in enumerate(chorales):
+        start, end = offsets[i], offsets[i + 1]
+        for v, voice in enumerate(voices):
+            assert len(chorale[voice]) == end - start
+            tokens[v, start:end] = chorale[voice]
+    tokens.flush()
+    del tokens
+
+    np.save(os.path.join(path, 'offsets.npy'), offsets)
+
+    meta = {'voices': list(voices),
+            'vocab': list(vocab),
+            'keys': [str(k) for k in keys] if keys is not None else list(range(len(chorales))),
+            'dtype': np.dtype(dtype).name}
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    return TokenStore(path)
@@ -0,0 +1,311 @@
+"""
+Compact integer tokens for a piece: per time step, the MIDI pitch as one
+signed byte (REST = -1) and an onset flag, instead of 'E-4' / 'contE-4'
+/ 'rest' strings. A token list converts to and from that form as:
+
+    'rest'     <->  (REST, onset)
+    '<Note>'   <->  (midi(Note), onset)
+    'cont<Note>' <-> (midi(Note), not onset)
+
+Note names come back spelled as in the token vocabulary (flats, see
+util.get_normalized_note_names).
+"""
+from functools import lru_cache
+
+import numpy as np
+
+import util
+import midi_writer
+from vocab import MIDI_NAMES, note_name_to_midi, vocab_tables
+
+REST = -1
+
+# util.code_runs tables for the codes (pitch + 1) * 2 + is_cont; every
+# rest gets its own base id, so rests never merge into one run
+_RUN_IS_CONT = np.arange(258) % 2 == 1
+_RUN_BASE = np.repeat(np.arange(-1, 128), 2)
+_RUN_BASE[:2] = [-2, -3]
+
+
+class ChoraleTokens:
+    """
+    Integer tokens of all parts of one piece.
+
+    The parts are stored back to back in two flat arrays, pitch (int8) and
+    onset (bool); part i spans offsets[i]:offsets[i+1]. That is two bytes
+    per time step and part, and every conversion is a table lookup or an
+    array operation.
+    """
+    __slots__ = ('parts', 'pitch', 'onset', 'offsets', 'time_step')
+
+    def __init__(self, parts, pitch, onset, offsets, time_step=0.25):
+        self.parts = list(parts)
+        self.pitch = np.asarray(pitch, dtype=np.int8)
+        self.onset = np.asarray(onset, dtype=bool)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.time_step = time_step
+
+    @classmethod
+    def from_arrays(cls, arrays, time_step=0.25):
+        """
+        Build from {part: (pitch, onset)} array pairs.
+        """
+        lengths = [len(p) for p, _ in arrays.values()]
+        offsets = np.concatenate(([0], np.cumsum(lengths, dtype=np.int64)))
+        if not arrays:
+            return cls([], [], [], offsets, time_step)
+        pitch = np.concatenate([p for p, _ in arrays.values()])
+        onset = np.concatenate([o for _, o in arrays.values()])
+        return cls(arrays.keys(), pitch, onset, offsets, time_step)
+
+    @classmethod
+    def from_note_dict(cls, note_dict, time_step=0.25):
+        """
+        Convert a note_dict of 'rest', '<Note>' and 'cont<Note>' tokens.
+        """
+        arrays = {}
+        for part, part_tokens in note_dict.items():
+            # Only the distinct tokens are parsed
+            index = {}
+            codes = np.fromiter((index.setdefault(t, len(index)) for t in part_tokens),
+                                dtype=np.int64, count=len(part_tokens))
+            pitch = np.empty(len(index), dtype=np.int8)
+            onset = np.empty(len(index), dtype=bool)
+            for k, token in enumerate(index):
+                onset[k] = not token.startswith('cont')
+                name = token if onset[k] else token[4:]
+                pitch[k] = REST if name == 'rest' else note_name_to_midi(name)
+            arrays[part] = (pitch[codes], onset[codes])
+        return cls.from_arrays(arrays, time_step)
+
+    def __len__(self):
+        return len(self.parts)
+
+    def __getitem__(self, part):
+        """
+        (pitch, onset) views of one part.
+        """
+        i = self.parts.index(part)
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.pitch[start:end], self.onset[start:end]
+
+    def __getstate__(self):
+        return (self.parts, self.pitch, self.onset, self.offsets, self.time_step)
+
+    def __setstate__(self, state):
+        self.parts, self.pitch, self.onset, self.offsets, self.time_step = state
+
+    def __eq__(self, other):
+        return (isinstance(other, ChoraleTokens) and self.parts == other.parts
+                and self.time_step == other.time_step
+                and np.array_equal(self.offsets, other.offsets)
+                and np.array_equal(self.pitch, other.pitch)
+                and np.array_equal(self.onset, other.onset))
+
+    @property
+    def nbytes(self):
+        return self.pitch.nbytes + self.onset.nbytes + self.offsets.nbytes
+
+    def part_lengths(self):
+        return dict(zip(self.parts, np.diff(self.offsets).tolist()))
+
+    def select(self, parts):
+        """
+        New ChoraleTokens with only the given parts, in that order.
+        """
+        return ChoraleTokens.from_arrays({part: self[part] for part in parts}, self.time_step)
+
+    def to_note_dict(self):
+        names = np.array(['rest'] + MIDI_NAMES + ['rest'] + ['cont' + n for n in MIDI_NAMES],
+                         dtype=object)
+        note_dict = {}
+        for part in self.parts:
+            pitch, onset = self[part]
+            # Rests are always written as 'rest', whatever their flag
+            codes = (pitch.astype(np.int64) + 1) + 129 * ((~onset) & (pitch != REST))
+            note_dict[part] = names[codes].tolist()
+        return note_dict
+
+    def runs(self, part):
+        """
+        Notes and rests of one part as runs (see util.code_runs).
+
+        Returns:
+            pitches (np.ndarray): MIDI pitch of each run, REST for rests.
+            lengths (np.ndarray): Number of time steps in each run.
+        """
+        pitch, onset = self[part]
+        pitch = pitch.astype(np.int64)
+        starts, lengths = util.code_runs((pitch + 1) * 2 + ~onset, _RUN_IS_CONT, _RUN_BASE)
+        return pitch[starts], lengths
+
+    def to_score(self):
+        """
+        music21 Score, the same as util.reconstruct_score_cont builds from
+        the equivalent note_dict.
+        """
+        runs = {}
+        for part in self.parts:
+            pitches, lengths = self.runs(part)
+            runs[part] = (['rest' if p == REST else MIDI_NAMES[p] for p in pitches.tolist()],
+                          lengths)
+        return util.score_from_runs(runs, self.time_step)
+
+    def to_midi(self, **kwargs):
+        """
+        Standard MIDI File bytes; keyword arguments go to midi_writer.runs_to_midi.
+        """
+        return midi_writer.runs_to_midi({part: self.runs(part) for part in self.parts},
+                                        time_step=self.time_step, **kwargs)
+
+    def to_indices(self, vocab):
+        """
+        Vocabulary indices per part, e.g. with vocab = iton as a list.
+        Tokens outside the vocabulary raise a KeyError.
+        """
+        lut = _index_table(tuple(vocab))
+        encoded = {}
+        for part in self.parts:
+            pitch, onset = self[part]
+            codes = lut[(pitch.astype(np.int64) + 1) * 2 + (~onset & (pitch != REST))]
+            if (codes < 0).any():
+                bad = np.flatnonzero(codes < 0)[0]
+                raise KeyError(f"{part}: token {self.to_note_dict()[part][bad]!r} is not in the vocabulary")
+            encoded[part] = codes
+        return encoded
+
+    @classmethod
+    def from_indices(cls, encoded, vocab, time_step=0.25):
+        """
+        Inverse of to_indices; '.' delimiters become rests.
+        """
+        midi, is_cont, _ = vocab_tables(vocab)
+        arrays = {}
+        for part, codes in encoded.items():
+            codes = np.asarray(codes, dtype=np.int64)
+            pitch = midi[codes]
+            arrays[part] = (np.where(pitch < 0, REST, pitch), ~is_cont[codes])
+        return cls.from_arrays(arrays, time_step)
+
+
+@lru_cache(maxsize=None)
+def _index_table(vocab):
+    # (pitch + 1) * 2 + is_cont -> vocabulary index, -1 when absent
+    midi, is_cont, _ = vocab_tables(vocab)
+    lut = np.full(258, -1, dtype=np.int64)
+    for i, token in enumerate(vocab):
+        if token == 'rest':
+            lut[0] = i
+        elif midi[i] >= 0:
+            lut[(midi[i] + 1) * 2 + is_cont[i]] = i
+    return lut
+
+
+def _part_events(part):
+    """
+    Integer version of util._part_events: per event, the onset pitch, the
+    pitch and onset flag of its remaining steps (None for chords), and its
+    quarterLength. Pitches are those of the normalized note names, so
+    results match the string tokenizer exactly.
+    """
+    onset_pitch = []
+    cont_pitch = []
+    durs = []
+    min_dur = None
+    # A chord before any note or rest (which the string tokenizer turns into
+    # None tokens) is read as a rest
+    last_pitch = REST
+
+    for n in util.iter_notes_and_rests(part):
+        dur = n.quarterLength
+        if min_dur is None or dur < min_dur:
+            min_dur = dur
+        if dur == 0.:
+            continue
+
+        if n.isRest:
+            last_pitch = REST
+            cont = (REST, True)
+        elif n.isNote:
+            last_pitch = _normalized_midi(n.pitch)
+            cont = (last_pitch, False)
+        else:
+            # Chords repeat the previous onset, as in the string tokenizer
+            cont = None
+
+        onset_pitch.append(last_pitch)
+        cont_pitch.append(cont)
+        durs.append(dur)
+
+    if min_dur is None:
+        raise ValueError(f"Part {part.id} has no notes or rests")
+
+    return onset_pitch, cont_pitch, durs, min_dur
+
+
+# (pitch name, octave) -> MIDI number of the normalized note name
+_normalized_midis = {}
+
+
+def _normalized_midi(p):
+    key = (p.name, p.octave)
+    midi = _normalized_midis.get(key)
+    if midi is None:
+        midi = _normalized_midis[key] = note_name_to_midi(util.normalized_note_name(p))
+    return midi
+
+
+def _expand(onset_pitch, cont_pitch, durs, time_step):
+    steps = (np.asarray(durs, dtype=float) / time_step).astype(np.int64)
+    np.maximum(steps, 1, out=steps)
+
+    if None in cont_pitch:
+        # Chords continue with the last continuation actually emitted
+        cont_pitch = list(cont_pitch)
+        last = (REST, True)
+        for k, cont in enumerate(cont_pitch):
+            if cont is None:
+                cont_pitch[k] = last
+            elif steps[k] > 1:
+                last = cont
+
+    conts = np.array(cont_pitch, dtype=np.int64).reshape(-1, 2)
+    pitch = np.repeat(conts[:, 0], steps).astype(np.int8)
+    onset = np.repeat(conts[:, 1].astype(bool), steps)
+    starts = np.cumsum(steps) - steps
+    pitch[starts] = onset_pitch
+    onset[starts] = True
+    return pitch, onset
+
+
+def extract_chorale_tokens(score, time_step=0.25):
+    """
+    Integer counterpart of util.extract_notes_and_durations_cont: the same
+    tokens, without building a string per time step. As there, a list or
+    tuple of time steps gives one grid per time step from a single walk
+    over the score.
+
+    Returns:
+        (tokens, part_duration, min_dur): ChoraleTokens of all parts (or
+        {time_step: ChoraleTokens}), total quarterLength per part, and the
+        shortest quarterLength overall.
+    """
+    multi = isinstance(time_step, (list, tuple))
+    time_steps = list(time_step) if multi else [time_step]
+    arrays = {ts: {} for ts in time_steps}
+    part_duration = {}
+    min_dur = 100.
+
+    for part in score.parts:
+        part_id = part.id or f"Part{len(part_duration)+1}"
+
+        onset_pitch, cont_pitch, durs, cur_min_dur = _part_events(part)
+        if cur_min_dur < min_dur:
+            min_dur = cur_min_dur
+
+        part_duration[part_id] = sum(durs, 0.)
+        for ts in time_steps:
+            arrays[ts][part_id] = _expand(onset_pitch, cont_pitch, durs, ts)
+
+    grids = {ts: ChoraleTokens.from_arrays(arrays[ts], ts) for ts in time_steps}
+    return (grids if multi else grids[time_step]), part_duration, min_dur
@@ -0,0 +1,202 @@
+"""
+Data-parallel MultiPartGenerator training on the CPU cores of one machine.
+
+N processes each hold a replica of the model and run model.fit on it,
+wrapped in DistributedDataParallel, which averages the gradients over the
+gloo backend so all replicas take the same optimizer step. Each process
+reads its SequenceChunks lazily from the shared TokenStore, through an
+EpochSampler shard of the epoch's permutation, so the k-th batches of all
+processes together are the k-th batch of a single process with the same
+total batch size. Each process's loss is weighted by its share of the
+batch's targets (TargetShare). N processes therefore write the same
+checkpoints (up to float summation order) as one process, except that up
+to N-1 chunks left over by the sharding are skipped each epoch; with
+drop_last, which also skips the partial last batch, they match exactly.
+
+    python train_parallel.py --processes 4
+    python train_parallel.py --scaling 1 2 4 8 --max-steps 50
+"""
+import os
+import json
+import time
+import socket
+import tempfile
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader
+
+import model as mdl
+import token_store
+
+DEFAULTS = {'store': 'bach_tokens', 'chunk_length': 64, 'batch_size': 64, 'epochs': 20,
+            'lr': 0.001, 'seed': 0, 'max_steps': None, 'drop_last': False, 'threads': None,
+            'checkpoint_path': None, 'checkpoint_every': 1000, 'log_every': 100}
+
+
+class TargetShare:
+    """
+    loss_weight for model.fit: this process's share of the batch's targets,
+    times the number of processes. DDP averages gradients over processes,
+    so weighting each process's mean loss this way makes that the mean
+    over the whole batch. Also counts the windows of all processes, timed
+    from the first batch on (after warm-up).
+    """
+
+    def __init__(self, world_size):
+        self.world_size = world_size
+        self.windows, self.t0 = 0, None
+
+    def __call__(self, yn):
+        counts = torch.tensor([float((yn != mdl.IGNORE).sum())])
+        local = counts.item()
+        dist.all_reduce(counts)
+        if self.t0 is None:
+            self.t0 = time.perf_counter()
+        else:
+            # A supervised timestep counts as one window, as in model.fit
+            self.windows += counts.item() / yn.shape[-1]
+        return local * self.world_size / counts.item()
+
+    def rate(self):
+        elapsed = time.perf_counter() - self.t0 if self.t0 is not None else 0.
+        return self.windows / elapsed if elapsed else None
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _train(rank, world_size, config):
+    if config['batch_size'] % world_size:
+        raise ValueError(f"batch_size {config['batch_size']} is not a multiple of "
+                         f"{world_size} processes")
+
+    # Every process maps the same store and reads only its own chunks
+    store = token_store.TokenStore(config['store'])
+    dataset = mdl.SequenceChunks(store, config['chunk_length'], seed=config['seed'])
+    # drop_last drops the same partial global batch for any world_size
+    loader = DataLoader(dataset, batch_size=config['batch_size'] // world_size,
+                        sampler=mdl.EpochSampler(dataset, world_size, rank),
+                        drop_last=config['drop_last'])
+
+    torch.manual_seed(config['seed'])
+    ddp = DistributedDataParallel(mdl.MultiPartGenerator(len(store.vocab), 1))
+    share = TargetShare(world_size)
+    history = mdl.fit(ddp, loader, epochs=config['epochs'], lr=config['lr'],
+                      checkpoint_path=config['checkpoint_path'],
+                      checkpoint_every=config['checkpoint_every'],
+                      log_every=config['log_every'], loss_weight=share,
+                      max_steps=config['max_steps'])
+
+    return {'processes': world_size, 'steps': len(history),
+            'loss': history[-1] if history else None,
+            'windows_per_sec': share.rate()}
+
+
+def _worker(rank, world_size, port, config, results):
+    torch.set_num_threads(config['threads'])
+    dist.init_process_group('gloo', init_method=f"tcp://127.0.0.1:{port}",
+                            rank=rank, world_size=world_size)
+    try:
+        result = _train(rank, world_size, config)
+        if rank == 0:
+            results.put(result)
+    finally:
+        dist.destroy_process_group()
+
+
+def train(processes=1, **config):
+    """
+    Train in `processes` worker processes; keyword arguments override
+    DEFAULTS. threads=None gives every process an equal share of the cores.
+
+    Returns:
+        dict: 'processes', 'steps', final 'loss' and 'windows_per_sec'
+        (all processes together).
+    """
+    unknown = set(config) - set(DEFAULTS)
+    if unknown:
+        raise TypeError(f"unknown options: {sorted(unknown)}")
+    config = {**DEFAULTS, **config}
+    if config['threads'] is None:
+        config['threads'] = max(1, (os.cpu_count() or 1) // processes)
+
+    results = mp.get_context('spawn').SimpleQueue()
+    mp.spawn(_worker, args=(processes, _free_port(), config, results), nprocs=processes)
+    return results.get()
+
+
+def max_difference(path_a, path_b):
+    """
+    Largest absolute difference between the weights of two checkpoints.
+    """
+    a, b = torch.load(path_a)['model'], torch.load(path_b)['model']
+    return max((a[k] - b[k]).abs().max().item() for k in a)
+
+
+def scaling_report(process_counts=(1, 2, 4, 8), max_steps=50, output=None, **config):
+    """
+    Windows/sec for each number of processes, over the same max_steps
+    global batches, dropping partial batches so that every run sees the
+    same ones. Each run's checkpoint is compared with that of the first
+    (normally single-process) run.
+
+    Returns:
+        list: One dict per run, with 'speedup', 'efficiency' and
+        'max_param_diff' relative to the first run.
+    """
+    report = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in process_counts:
+            checkpoint = os.path.join(tmp, f"{n}.pt")
+            result = train(n, max_steps=max_steps, checkpoint_path=checkpoint,
+                           **{**config, 'drop_last': True})
+            base = report[0] if report else result
+            result['speedup'] = result['windows_per_sec'] / base['windows_per_sec']
+            result['efficiency'] = result['speedup'] * base['processes'] / n
+            result['max_param_diff'] = max_difference(
+                os.path.join(tmp, f"{base['processes']}.pt"), checkpoint)
+            report.append(result)
+            print(f"{n:3d} processes  {result['windows_per_sec']:10.0f} windows/sec  "
+                  f"speedup {result['speedup']:5.2f}  efficiency {result['efficiency']:5.2f}  "
+                  f"max param diff {result['max_param_diff']:.2e}")
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump({'cpu_count': os.cpu_count(), 'runs': report}, f, indent=2)
+    return report
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--scaling', type=int, nargs='+', default=None,
+                        help="process counts to benchmark instead of training")
+    parser.add_argument('--store', default=DEFAULTS['store'])
+    parser.add_argument('--chunk-length', type=int, default=DEFAULTS['chunk_length'])
+    parser.add_argument('--batch-size', type=int, default=DEFAULTS['batch_size'])
+    parser.add_argument('--epochs', type=int, default=DEFAULTS['epochs'])
+    parser.add_argument('--lr', type=float, default=DEFAULTS['lr'])
+    parser.add_argument('--seed', type=int, default=DEFAULTS['seed'])
+    parser.add_argument('--max-steps', type=int, default=None)
+    parser.add_argument('--threads', type=int, default=None, help="torch threads per process")
+    parser.add_argument('--checkpoint', default='multipart_generator.pt')
+    parser.add_argument('--output', default='scaling_report.json')
+    args = parser.parse_args()
+
+    config = {'store': args.store, 'chunk_length': args.chunk_length,
+              'batch_size': args.batch_size, 'epochs': args.epochs, 'lr': args.lr,
+              'seed': args.seed, 'threads': args.threads}
+    if args.scaling:
+        scaling_report(args.scaling, max_steps=args.max_steps or 50, output=args.output, **config)
+    else:
+        result = train(args.processes, max_steps=args.max_steps,
+                       checkpoint_path=args.checkpoint, **config)
+        print(f"{result['processes']} processes: {result['windows_per_sec']:.0f} windows/sec")
@@ -1,5 +1,12 @@
+import gc
 import random
-from music21 import stream, note, converter, pitch
+
+import numpy as np
+
+import vocab
+
+# music21 takes a while to import, so it is imported only inside the
+# functions that build or walk scores; token-only code never loads it
 
 # def extract_notes_and_durations(score):
 #     note_dict = {'soprano': [], 'alto': [], 'tenor': [], 'bass': []}
@@ -150,6 +157,8 @@ def reconstruct_score(note_dict, duration_dict):
     Returns:
         music21.stream.Score: A Score object containing all parts
     """
+    from music21 import stream, note
+
     score = stream.Score()
 
     for part_name in note_dict:
@@ -177,22 +186,7 @@ def build_pitch_vocab(low='E2', high='C5'):
     including accidentals (sharps and flats) without duplicates.
     Also includes a 'rest' token.
     """
-    low_midi = pitch.Pitch(low).midi
-    high_midi = pitch.Pitch(high).midi
-
-    seen = set()
-    pitches = []
-
-    for midi_num in range(low_midi, high_midi + 1):
-        p = pitch.Pitch(midi=midi_num)
-        name = p.nameWithOctave
-        if name not in seen:
-            seen.add(name)
-            pitches.append(name)
-
-    # Add 'rest' token at the start
-    pitch_vocab = ['rest'] + pitches
-    return pitch_vocab
+    return vocab.pitch_names(low, high)
 
 
 def encode_sequences(note_dict, duration_dict):
@@ -227,73 +221,252 @@ def encode_sequences(note_dict, duration_dict):
 
     return pitch2idx, duration2idx, encoded_notes, encoded_durations
 
+# Enharmonic respelling applied by extract_notes_and_durations_cont:
+# sharps become flats (or naturals), F- becomes E and C- becomes B.
+# Maps pitch name -> (new name, octave shift).
+ENHARMONIC_FIXES = {
+    'C#': ('D-', 0), 'C##': ('D', 0), 'C###': ('D#', 0),
+    'D#': ('E-', 0), 'D##': ('E', 0), 'D###': ('E#', 0),
+    'E#': ('F', 0), 'E##': ('F#', 0), 'E###': ('F##', 0),
+    'F#': ('G-', 0), 'F##': ('G', 0), 'F###': ('G#', 0),
+    'G#': ('A-', 0), 'G##': ('A', 0), 'G###': ('A#', 0),
+    'A#': ('B-', 0), 'A##': ('B', 0), 'A###': ('B#', 0),
+    'B#': ('C', 1), 'B##': ('C#', 1), 'B###': ('C##', 1),
+    'F-': ('E', 0), 'C-': ('B', 0),
+}
+
+# (pitch name, octave) -> normalized nameWithOctave, filled on first use
+_normalized_names = {}
+
+
+def normalized_note_name(p):
+    """
+    Spelling of a music21 Pitch used in the token vocabulary, computed
+    from ENHARMONIC_FIXES without modifying the pitch.
+    """
+    key = (p.name, p.octave)
+    name = _normalized_names.get(key)
+    if name is None:
+        if p.name in ENHARMONIC_FIXES:
+            new_name, shift = ENHARMONIC_FIXES[p.name]
+            octave = '' if p.octave is None else str(p.octave + shift)
+            name = new_name + octave
+        elif '#' in p.name:
+            # Microtonal and other rare spellings: same rules on a copy
+            q = p.getEnharmonic()
+            if q.name == 'F-':
+                q.name = 'E'
+            if q.name == 'C-':
+                q.name = 'B'
+            name = q.nameWithOctave
+        else:
+            name = p.nameWithOctave
+        _normalized_names[key] = name
+    return name
+
+
+def iter_notes_and_rests(s):
+    """
+    Same elements, in the same order, as s.recurse().notesAndRests, without
+    the iterator's per-element active-site bookkeeping.
+    """
+    from music21 import stream, note
+
+    for el in s.elements:
+        if isinstance(el, note.GeneralNote):
+            yield el
+        elif isinstance(el, stream.Stream):
+            yield from iter_notes_and_rests(el)
+
+
+def _part_events(part):
+    """
+    Collect the events of one part in a single pass.
+
+    Returns:
+        onsets (list): Token of the first time step of each event.
+        conts (list): Token of the remaining time steps of each event,
+            None for chords (resolved in _expand_events).
+        durs (list): quarterLength of each event.
+        min_dur (float): Shortest quarterLength in the part, including
+            zero-length grace notes, which are otherwise dropped.
+    """
+    onsets = []
+    conts = []
+    durs = []
+    min_dur = None
+    note_name = None
+
+    for n in iter_notes_and_rests(part):
+        dur = n.quarterLength
+        if min_dur is None or dur < min_dur:
+            min_dur = dur
+        if dur == 0.:
+            continue
+
+        if n.isRest:
+            note_name = cont_token = 'rest'
+        elif n.isNote:
+            note_name = normalized_note_name(n.pitch)
+            cont_token = 'cont' + note_name
+        else:
+            # Anything else (chords) repeats the previous onset token
+            cont_token = None
+
+        onsets.append(note_name)
+        conts.append(cont_token)
+        durs.append(dur)
+
+    if min_dur is None:
+        raise ValueError(f"Part {part.id} has no notes or rests")
+
+    return onsets, conts, durs, min_dur
+
+
+def _expand_events(onsets, conts, durs, time_step):
+    """
+    Expand events to the time_step grid: each event fills
+    max(1, int(dur / time_step)) steps, its onset token followed by
+    continuation tokens.
+    """
+    steps = (np.asarray(durs, dtype=float) / time_step).astype(np.int64)
+    np.maximum(steps, 1, out=steps)
+
+    if None in conts:
+        # Chords continue with the last continuation token actually emitted
+        conts = list(conts)
+        last = None
+        for k, cont in enumerate(conts):
+            if cont is None:
+                conts[k] = last
+            elif steps[k] > 1:
+                last = cont
+
+    tokens = np.repeat(np.array(conts, dtype=object), steps)
+    starts = np.cumsum(steps) - steps
+    tokens[starts] = onsets
+    return tokens.tolist()
+
+
 def extract_notes_and_durations_cont(score, time_step=0.25):
     """
     Extract aligned note and duration sequences from a music21 Score.
     Long notes are split into time_step units using 'cont<NoteName>' markers.
+    Sharps are respelled as flats (see ENHARMONIC_FIXES); the score itself
+    is left untouched.
 
     Args:
         score (music21.stream.Score): Input Score.
-        time_step (float): Temporal resolution (e.g., 0.5 = eighth notes).
+        time_step (float or list): Temporal resolution (e.g., 0.5 = eighth
+            notes). Given a list or tuple of time steps, the score is walked
+            once and a grid is built for each from the same events.
 
     Returns:
-        (note_dict, duration_dict): Dicts of aligned note names and durations.
+        (note_dict, duration_dict, part_duration, min_dur): Dicts of aligned
+        note names and durations, total quarterLength per part, and the
+        shortest quarterLength over all parts. With several time steps,
+        note_dict and duration_dict are {time_step: dict}; see
+        resolution_flags for which of them the piece is usable at.
     """
-    note_dict = {}
-    duration_dict = {}
+    multi = isinstance(time_step, (list, tuple))
+    time_steps = list(time_step) if multi else [time_step]
+    note_dicts = {ts: {} for ts in time_steps}
+    duration_dicts = {ts: {} for ts in time_steps}
     part_duration = {}
     min_dur = 100.
 
     for part in score.parts:
-        part_id = part.id or f"Part{len(note_dict)+1}"
-        note_dict[part_id] = []
-        duration_dict[part_id] = []
-        part_duration[part_id] = 0.
-        
-        
-        cur_min_dur = min([s.quarterLength for s in part.recurse().notesAndRests])
+        part_id = part.id or f"Part{len(part_duration)+1}"
+
+        onsets, conts, durs, cur_min_dur = _part_events(part)
         if cur_min_dur < min_dur:
             min_dur = cur_min_dur
-            
-        for n in part.recurse().notesAndRests:
-                        
-            dur = n.quarterLength
-            if dur == 0.:
-                continue
-            
-            part_duration[part_id] += dur
-            steps = int(dur / time_step)
-            if steps < 1:
-                steps = 1
 
-            if n.isRest:
-                note_name = 'rest'
-            elif n.isNote:
-                if '#' in n.pitch.name:
-                    n.pitch = n.pitch.getEnharmonic()
-                if n.pitch.name == 'F-':
-                    n.pitch.name = 'E'
-                if n.pitch.name == 'C-':
-                    n.pitch.name = 'B'
-                note_name = n.nameWithOctave
-            else:
-                # print('What is this!')
-                pass
+        part_duration[part_id] = sum(durs, 0.)
+        for ts in time_steps:
+            note_dicts[ts][part_id] = _expand_events(onsets, conts, durs, ts)
+            duration_dicts[ts][part_id] = [ts] * len(note_dicts[ts][part_id])
+
+    if multi:
+        return note_dicts, duration_dicts, part_duration, min_dur
+    return note_dicts[time_step], duration_dicts[time_step], part_duration, min_dur
+
 
-            note_dict[part_id].append(note_name)
-            duration_dict[part_id].append(time_step)
+def resolution_flags(min_dur, time_steps):
+    """
+    Whether a piece whose shortest note is min_dur can be used at each
+    time step, i.e. no note is shorter than one step.
 
-            for _ in range(1, steps):
-                if n.isRest:
-                    cont_token = note_name
-                elif n.isNote:
-                    cont_token = f"cont{note_name}"
-                note_dict[part_id].append(cont_token)
-                duration_dict[part_id].append(time_step)
-                
+    Returns:
+        dict: {time_step: bool}
+    """
+    return {ts: bool(min_dur >= ts) for ts in time_steps}
 
-    return note_dict, duration_dict, part_duration, min_dur
 
+def code_runs(codes, is_cont, base):
+    """
+    Split integer-coded tokens into runs of one onset token followed by
+    its continuations, in one vectorized pass.
+
+    A run starts at every onset token and wherever the underlying note
+    changes. Runs that start with a continuation token (continuations that
+    do not follow their own note) are dropped.
+
+    Args:
+        codes (np.ndarray): Token code per time step.
+        is_cont (np.ndarray): Per code, True for 'cont<Note>' tokens.
+        base (np.ndarray): Per code, an id of the underlying note, equal for
+            a note and its continuation token.
+
+    Returns:
+        starts (np.ndarray): Index of the onset token of each run.
+        lengths (np.ndarray): Number of time steps in each run.
+    """
+    codes = np.asarray(codes)
+    if len(codes) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty
+
+    cont = is_cont[codes]
+    note_ids = base[codes]
+
+    starts = ~cont
+    starts[1:] |= note_ids[1:] != note_ids[:-1]
+    starts[0] = True
+    starts = np.flatnonzero(starts)
+    lengths = np.diff(np.append(starts, len(codes)))
+
+    keep = ~cont[starts]
+    return starts[keep], lengths[keep]
+
+
+def token_runs(tokens):
+    """
+    Runs of a token list (see code_runs).
+
+    Args:
+        tokens (list): Note names, 'rest' and 'cont<Note>' tokens.
+
+    Returns:
+        symbols (list): Onset token of each run.
+        lengths (np.ndarray): Number of time steps in each run.
+    """
+    if len(tokens) == 0:
+        return [], np.zeros(0, dtype=np.int64)
+
+    # Work on small integer codes; only the distinct tokens are inspected
+    index = {}
+    codes = np.fromiter((index.setdefault(t, len(index)) for t in tokens),
+                        dtype=np.int64, count=len(tokens))
+    uniq = list(index)
+    is_cont = np.array([u.startswith('cont') for u in uniq])
+    bases = [u[4:] if c else u for u, c in zip(uniq, is_cont)]
+    base_ids = {b: i for i, b in enumerate(dict.fromkeys(bases))}
+    base = np.array([base_ids[b] for b in bases])
+
+    starts, lengths = code_runs(codes, is_cont, base)
+    symbols = [uniq[c] for c in codes[starts].tolist()]
+    return symbols, lengths
 
 
 def reconstruct_score_cont(note_dict, time_step=0.25):
@@ -307,38 +480,53 @@ def reconstruct_score_cont(note_dict, time_step=0.25):
     Returns:
         music21.stream.Score
     """
-    from music21 import stream, note
+    return score_from_runs({part_name: token_runs(tokens)
+                            for part_name, tokens in note_dict.items()}, time_step)
 
-    score = stream.Score()
 
-    for part_name in note_dict:
-        p = stream.Part()
-        p.id = part_name
-        p.partName = part_name.capitalize()
+def score_from_runs(runs, time_step=0.25):
+    """
+    Build a music21 Score from per-part runs.
 
-        notes = note_dict[part_name]
-        i = 0
-        while i < len(notes):
-            symbol = notes[i]
-            if symbol.startswith('cont'):
-                i += 1
-                continue
-
-            # Determine how long this note continues
-            dur = time_step
-            j = i + 1
-            while j < len(notes) and notes[j] == f'cont{symbol}':
-                dur += time_step
-                j += 1
-
-            if symbol == 'rest':
-                p.append(note.Rest(quarterLength=dur))
-            else:
-                p.append(note.Note(symbol, quarterLength=dur))
+    Args:
+        runs (dict): {part_name: (symbols, lengths)}, the note name or
+            'rest' and the length in time steps of each run.
+        time_step (float): Duration of each time step.
+
+    Returns:
+        music21.stream.Score
+    """
+    from music21 import stream, note, duration
 
-            i = j
+    score = stream.Score()
 
-        score.append(p)
+    # Building thousands of music21 objects keeps triggering the cyclic
+    # garbage collector, although nothing here becomes garbage
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for part_name, (symbols, lengths) in runs.items():
+            p = stream.Part()
+            p.id = part_name
+            p.partName = part_name.capitalize()
+
+            durs = (np.asarray(lengths) * time_step).tolist()
+            offsets = np.concatenate(([0.], np.cumsum(durs)[:-1])).tolist()
+
+            # Insert everything at precomputed offsets, then update the part
+            # once. Passing a Duration skips the slower quarterLength path.
+            for symbol, dur, offset in zip(symbols, durs, offsets):
+                if symbol == 'rest':
+                    n = note.Rest(duration=duration.Duration(dur))
+                else:
+                    n = note.Note(symbol, duration=duration.Duration(dur))
+                p.coreInsert(offset, n)
+            p.coreElementsChanged()
+
+            score.append(p)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
 
     return score
 
@@ -355,25 +543,8 @@ def get_normalized_note_names(low='E2', high='C7'):
     Returns:
         List of unique note names with flats/naturals only.
     """
-    low_midi = pitch.Pitch(low).midi
-    high_midi = pitch.Pitch(high).midi
-
-    note_names = []
-
-    for midi_num in range(low_midi, high_midi + 1):
-        p = pitch.Pitch(midi=midi_num)
-        # Convert sharp/double-sharp notes to their flat/natural enharmonic equivalent
-        if '#' in p.name:
-            p = p.getEnharmonic()
-
-        note_names.append(p.nameWithOctave)
-        note_names.append('cont'+p.nameWithOctave)
-        
-
-    # Remove duplicates and sort
-    return sorted(set(note_names))
-
-
+    # Precomputed from MIDI numbers; no music21 Pitch objects needed
+    return vocab.normalized_note_names(low, high)
 
 
 def get_total_duration_per_part(score):
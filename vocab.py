@@ -0,0 +1,100 @@
+"""
+Static token vocabulary tables, computed from MIDI numbers with plain
+arithmetic so that nothing here needs music21.
+
+NOTES_VOCAB, NTOI and ITON are the tables create_dataset.py trains on:
+every normalized note name and its 'cont' token from C2 to C6, with
+'.' = 0 and 'rest' = 1.
+"""
+from functools import lru_cache
+
+import numpy as np
+
+STEP_SEMITONES = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11}
+
+# Spelling of each pitch class in the token vocabulary (sharps as flats)
+PITCH_CLASS_NAMES = ['C', 'D-', 'D', 'E-', 'E', 'F', 'G-', 'G', 'A-', 'A', 'B-', 'B']
+MIDI_NAMES = [PITCH_CLASS_NAMES[m % 12] + str(m // 12 - 1) for m in range(128)]
+
+# music21's default spelling of pitch.Pitch(midi=m), used by build_pitch_vocab
+DEFAULT_PITCH_CLASS_NAMES = ['C', 'C#', 'D', 'E-', 'E', 'F', 'F#', 'G', 'G#', 'A', 'B-', 'B']
+
+
+@lru_cache(maxsize=None)
+def note_name_to_midi(name):
+    """
+    MIDI number of a note name such as 'E-4', 'C#3' or 'B2' (octave 4
+    when none is given, as in music21).
+    """
+    semitone = STEP_SEMITONES[name[0]]
+    i = 1
+    while i < len(name) and name[i] in '#-':
+        semitone += 1 if name[i] == '#' else -1
+        i += 1
+    octave = int(name[i:]) if name[i:] else 4
+    return semitone + (octave + 1) * 12
+
+
+@lru_cache(maxsize=None)
+def _normalized_note_names(low, high):
+    names = set()
+    for m in range(note_name_to_midi(low), note_name_to_midi(high) + 1):
+        names.add(MIDI_NAMES[m])
+        names.add('cont' + MIDI_NAMES[m])
+    return tuple(sorted(names))
+
+
+def normalized_note_names(low='E2', high='C7'):
+    """
+    Sorted note names from low to high in the vocabulary spelling, each
+    with its 'cont' token (see util.get_normalized_note_names).
+    """
+    return list(_normalized_note_names(low, high))
+
+
+@lru_cache(maxsize=None)
+def _vocab_tables(vocab):
+    midi = np.full(len(vocab), -1, dtype=np.int64)
+    is_cont = np.zeros(len(vocab), dtype=bool)
+    for i, token in enumerate(vocab):
+        if token.startswith('cont'):
+            is_cont[i] = True
+            token = token[4:]
+        if token and token[0] in STEP_SEMITONES:
+            midi[i] = note_name_to_midi(token)
+    # A note and its continuation share a MIDI number; silent tokens are
+    # kept apart by their (negative) index so they never merge into a run
+    base = np.where(midi >= 0, midi, -1 - np.arange(len(vocab)))
+    for table in (midi, is_cont, base):
+        table.flags.writeable = False
+    return midi, is_cont, base
+
+
+def vocab_tables(vocab):
+    """
+    Per-token lookup arrays for a vocabulary (token name per index), cached
+    and read-only: MIDI pitch (-1 for 'rest', '.' and other silent tokens),
+    continuation flag and note id.
+    """
+    return _vocab_tables(tuple(vocab))
+
+
+def pitch_names(low='E2', high='C5'):
+    """
+    'rest' followed by the note names from low to high, in music21's
+    default spelling (see util.build_pitch_vocab).
+    """
+    return ['rest'] + [DEFAULT_PITCH_CLASS_NAMES[m % 12] + str(m // 12 - 1)
+                       for m in range(note_name_to_midi(low), note_name_to_midi(high) + 1)]
+
+
+NOTES_VOCAB = normalized_note_names(low='C2', high='C6')
+
+NTOI = {name: i + 2 for i, name in enumerate(NOTES_VOCAB)}
+NTOI['.'] = 0
+NTOI['rest'] = 1
+
+ITON = {i: name for name, i in NTOI.items()}
+
+# Token name for each index, as stored in TokenStore meta
+VOCAB = [ITON[i] for i in range(len(ITON))]